@@ -0,0 +1,144 @@
+import os
+import csv
+import json
+import logging
+
+from storage import User
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('jsonl', 'csv')
+# Telegram bots can download files up to 20 MB, so exported chunks stay
+# below that and can be imported again as they are
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(16 * 1024 * 1024)))
+IMPORT_BATCH = 1000
+
+FIELDS = ('user_id', 'username', 'points', 'referral_count', 'has_withdrawn', 'referred_by', 'active', 'referrals')
+
+def to_record(user):
+    return {
+        'user_id': user.user_id,
+        'username': user.username,
+        'points': user.points,
+        'referral_count': user.referral_count,
+        'has_withdrawn': user.has_withdrawn,
+        'referred_by': user.referred_by,
+        'active': user.active,
+        'referrals': sorted(user.referrals or ()),
+    }
+
+def from_record(record):
+    user = User(
+        int(record['user_id']), record.get('username'), int(record.get('points') or 0),
+        int(record.get('referral_count') or 0), bool(record.get('has_withdrawn')),
+        int(record['referred_by']) if record.get('referred_by') not in (None, '') else None,
+        bool(record.get('active', True)),
+    )
+    for referred_id in record.get('referrals') or ():
+        user.add_referral_id(int(referred_id))
+    return user
+
+class _ChunkFile:
+    """One export file: JSON lines, or CSV with referrals space-separated."""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self.users = 0
+        self._file = open(path, 'w', newline='')
+        if fmt == 'csv':
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(FIELDS)
+
+    def write(self, user):
+        record = to_record(user)
+        if self.fmt == 'csv':
+            record['has_withdrawn'] = int(record['has_withdrawn'])
+            record['active'] = int(record['active'])
+            record['referrals'] = ' '.join(map(str, record['referrals']))
+            self._csv.writerow([record[field] for field in FIELDS])
+        else:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.users += 1
+
+    def size(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+def export_chunks(store, directory, fmt='jsonl', chunk_bytes=EXPORT_CHUNK_BYTES, prefix='users'):
+    """Write every user in store to files of about chunk_bytes each.
+
+    Yields (path, user count) as each file is completed, so the caller can
+    send or move it before the next one is written. Only one batch of
+    users is held in memory at a time.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    number = 1
+    chunk = None
+    for user in store.iter_users(referrals=True):
+        if chunk is None:
+            chunk = _ChunkFile(os.path.join(directory, f"{prefix}-{number:04d}.{fmt}"), fmt)
+        chunk.write(user)
+        if chunk.size() >= chunk_bytes:
+            chunk.close()
+            yield chunk.path, chunk.users
+            number += 1
+            chunk = None
+    if chunk is not None:
+        chunk.close()
+        yield chunk.path, chunk.users
+
+def read_records(path):
+    """Yield user records from a JSONL or CSV export, one line at a time."""
+    with open(path, 'r', newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                row['has_withdrawn'] = row.get('has_withdrawn') in ('1', 'True', 'true')
+                row['active'] = row.get('active', '1') in ('1', 'True', 'true')
+                row['referrals'] = (row.get('referrals') or '').split()
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def read_batches(path, batch_size=IMPORT_BATCH):
+    """Yield lists of up to batch_size User records from an export file."""
+    batch = []
+    for record in read_records(path):
+        batch.append(from_record(record))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_file(store, path, batch_size=IMPORT_BATCH):
+    """Load an export file into store in batches; returns the number of users."""
+    count = 0
+    for batch in read_batches(path, batch_size):
+        store.import_users(batch)
+        count += len(batch)
+    logger.info(f"Imported {count} users from {path}")
+    return count
+
+if __name__ == '__main__':
+    import sys
+    from storage import SqliteStore, DB_FILE
+    logging.basicConfig(level=logging.INFO)
+    # Works on the database directly, so run it with the bot stopped
+    usage = "usage: python backup.py export DIR [jsonl|csv] | import FILE..."
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'import'):
+        sys.exit(usage)
+    store = SqliteStore(DB_FILE)
+    if sys.argv[1] == 'export':
+        fmt = sys.argv[3] if len(sys.argv) > 3 else 'jsonl'
+        for path, users in export_chunks(store, sys.argv[2], fmt):
+            print(f"Wrote {users} users to {path}")
+    else:
+        for path in sys.argv[2:]:
+            print(f"Imported {import_file(store, path)} users from {path}")
+    store.close()
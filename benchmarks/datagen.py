@@ -0,0 +1,64 @@
+"""Synthetic user_data.json files for benchmarks.
+
+Files use the legacy format bot.py used to write: string ids, referral
+lists of string ids and an indent of 4.
+
+    python -m benchmarks.datagen 100000 out.json [--shape power]
+"""
+import json
+import random
+import argparse
+
+SHAPES = ('none', 'uniform', 'power')
+
+def generate_users(count, shape='power', referral_ratio=0.6, seed=1, first_id=100000000):
+    """Return a {'users': ...} dict of count users.
+
+    shape picks who referred whom: 'none' has no referrals, 'uniform' picks
+    any earlier user, 'power' favours users who already have referrals
+    (preferential attachment), which gives a few very popular referrers.
+    """
+    rng = random.Random(seed)
+    ids = [str(first_id + i) for i in range(count)]
+    users = {}
+    # Every credited referral adds its referrer here once more, so picking
+    # uniformly from it is picking proportionally to referral count
+    attachment = []
+
+    for index, user_id in enumerate(ids):
+        referred_by = None
+        if shape != 'none' and index and rng.random() < referral_ratio:
+            if shape == 'power' and attachment and rng.random() < 0.8:
+                referred_by = rng.choice(attachment)
+            else:
+                referred_by = ids[rng.randrange(index)]
+            users[referred_by]['referrals'].append(user_id)
+            attachment.append(referred_by)
+        users[user_id] = {
+            'username': f"user{index}" if rng.random() < 0.7 else f"user_{user_id}",
+            'points': 0,
+            'referrals': [],
+            'has_withdrawn': False,
+            'referred_by': referred_by,
+        }
+    for user in users.values():
+        if len(user['referrals']) >= 3 and rng.random() < 0.3:
+            user['has_withdrawn'] = True
+    return {'users': users}
+
+def write_users(path, count, shape='power', seed=1):
+    with open(path, 'w') as f:
+        json.dump(generate_users(count, shape, seed=seed), f, indent=4)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('count', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--shape', choices=SHAPES, default='power')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    write_users(args.path, args.count, args.shape, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""A local stand-in for the Telegram Bot API.
+
+Answers the methods bot.py uses with canned results after a configurable
+latency, records every call, and can feed updates to a polling bot via
+getUpdates. Point the bot at it with BOT_API_URL=http://127.0.0.1:<port>.
+
+    python -m benchmarks.fake_bot_api [--port 8081] [--latency 0.05]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webserver import HTTPServer
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_bot'}
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, jitter=0.0, member_status='member'):
+        self.latency = latency
+        self.jitter = jitter
+        self.member_status = member_status
+        self.calls = defaultdict(int)
+        # Called as listener(method, params, timestamp) after each response is ready
+        self.listeners = []
+        self._updates = deque()
+        self._updates_ready = asyncio.Event()
+        self._message_id = 0
+        self._closing = False
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await FakeServer(self).start(host, port)
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.port}"
+
+    async def close(self):
+        # Answer pending long polls so their connections can finish
+        self._closing = True
+        self._updates_ready.set()
+        await self.server.close()
+
+    def push_update(self, update):
+        """Queue an update for the next getUpdates call."""
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates and not self._closing:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(params.get('timeout', 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)[:int(params.get('limit', 100) or 100)]
+
+    async def call(self, method, params):
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getChatMember':
+            user = {'id': int(params.get('user_id', 0)), 'is_bot': False, 'first_name': 'User'}
+            result = {'status': self.member_status, 'user': user}
+        elif method in ('sendMessage', 'editMessageText', 'sendPhoto', 'sendVideo', 'sendDocument'):
+            result = self._message(params)
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook, ...
+            result = True
+
+        now = time.perf_counter()
+        for listener in self.listeners:
+            listener(method, params, now)
+        return result
+
+class FakeServer(HTTPServer):
+    def __init__(self, api):
+        super().__init__({})
+        self.api = api
+        # Connection handler task -> its writer
+        self._connections = {}
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            await super()._handle(reader, writer)
+        finally:
+            del self._connections[task]
+
+    async def close(self):
+        await super().close()
+        # Let every connection end on its own; handlers still running when
+        # the loop stops would be cancelled and logged as errors
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _dispatch(self, request):
+        # Paths look like /bot<token>/<method>
+        method = request.path.rsplit('/', 1)[-1]
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('application/json'):
+            params = json.loads(request.body or b'{}')
+        elif content_type.startswith('multipart/'):
+            params = {}
+        else:
+            params = {k: v[0] for k, v in parse_qs(request.body.decode()).items()}
+        result = await self.api.call(method, params)
+        return 200, 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every call")
+    parser.add_argument('--jitter', type=float, default=0.02, help="extra random latency, up to this many seconds")
+    args = parser.parse_args()
+
+    async def serve():
+        api = await FakeBotAPI(args.latency, args.jitter).start(port=args.port)
+        print(f"Fake Bot API listening on {api.url}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""End-to-end load test of bot.py against the fake Bot API.
+
+Starts a FakeBotAPI, runs bot.py as a subprocess pointed at it, and drives
+synthetic users through /start (with referrals), "I've Joined", the menu
+buttons and admin broadcasts. Each step's latency is the time from
+delivering the update to the bot's reply reaching the fake API; referral
+notifications and broadcasts arriving meanwhile are not counted as replies.
+
+    python -m benchmarks.loadtest --users 500 --concurrency 100 --mode webhook
+    python -m benchmarks.loadtest --users 500 --workers 4
+    python -m benchmarks.loadtest --trace captured_updates.jsonl
+    python -m benchmarks.loadtest --json report.json --baseline last_report.json
+
+--trace replays a JSONL file of Telegram update objects (one per line)
+instead of generating traffic. With --baseline the run exits non-zero if
+throughput drops or p95 latency grows by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import callbacks
+from benchmarks.fake_bot_api import FakeBotAPI, BOT_USER
+
+ADMIN_ID = 42
+TOKEN = '123456:loadtest'
+CHART_EMOJI = "📊"
+LINK_EMOJI = "🔗"
+MONEY_EMOJI = "💰"
+MENU_BUTTONS = {
+    'menu_points': f"{CHART_EMOJI} My Points",
+    'menu_refer': f"{LINK_EMOJI} Refer Friends",
+    'menu_withdraw': f"{MONEY_EMOJI} Withdraw Reward",
+}
+# Messages the bot sends on its own rather than as a reply: referral
+# notifications and broadcasts. They must not complete a step that is
+# waiting for the reply to the user's own update.
+UNSOLICITED = ("Great news!", "You've referred 3 friends", "*ANNOUNCEMENT*")
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_id = 0
+
+    def _next_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"load{user_id}"}
+
+    def message(self, user_id, text):
+        update_id = self._next_id()
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        update_id = self._next_id()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': 'menu',
+                },
+            },
+        }
+
+    def renumber(self, update):
+        update = dict(update)
+        update['update_id'] = self._next_id()
+        return update
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.factory = UpdateFactory()
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        # chat_id -> future resolved by the next reply to that chat
+        self._waiting = {}
+        self.api = None
+        self.bot = None
+        self._client = None
+
+    def _on_api_call(self, method, params, now):
+        if method not in ('sendMessage', 'sendPhoto', 'sendVideo', 'sendDocument'):
+            return
+        text = params.get('text') or params.get('caption') or ''
+        if any(marker in text for marker in UNSOLICITED):
+            return
+        chat_id = int(params.get('chat_id', 0))
+        future = self._waiting.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(now)
+
+    async def start(self, workdir):
+        self.api = await FakeBotAPI(self.args.api_latency, self.args.api_jitter).start()
+        self.api.listeners.append(self._on_api_call)
+
+        with open(os.path.join(workdir, 'channels.json'), 'w') as f:
+            json.dump({
+                'channels': [
+                    {'name': f"Channel {i}", 'link': f"https://t.me/c{i}", 'id': str(-1000000000000 - i)}
+                    for i in range(self.args.channels)
+                ],
+                'folders': {},
+            }, f)
+
+        self.webhook_port = free_port()
+        env = dict(
+            os.environ,
+            BOT_TOKEN=TOKEN,
+            BOT_API_URL=self.api.url,
+            BOT_MODE=self.args.mode,
+            WEBHOOK_LISTEN='127.0.0.1',
+            WEBHOOK_PORT=str(self.webhook_port),
+            ADMIN_ID=str(ADMIN_ID),
+            DB_FILE=os.path.join(workdir, 'bot.db'),
+            CONCURRENT_UPDATES=str(self.args.concurrent_updates),
+            SHARD_WORKERS=str(self.args.workers),
+            WORKER_PORT=str(free_port()),
+        )
+        env.pop('WEBHOOK_URL', None)
+        env.pop('WEBHOOK_SECRET', None)
+        log = open(os.path.join(workdir, 'bot.log'), 'w')
+        self.bot = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, 'bot.py'),
+            cwd=workdir, env=env, stdout=log, stderr=log,
+        )
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100), timeout=30
+        )
+        await self._wait_ready()
+
+    async def _wait_ready(self):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.bot.returncode is not None:
+                raise RuntimeError("bot.py exited during startup, see bot.log")
+            ready = self.api.calls['getMe'] > 0
+            if ready and self.args.mode == 'webhook':
+                try:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', self.webhook_port)
+                    writer.close()
+                except OSError:
+                    ready = False
+            elif ready:
+                ready = self.api.calls['getUpdates'] > 0
+            if ready:
+                return
+            await asyncio.sleep(0.1)
+        raise RuntimeError("bot.py did not become ready within 30s")
+
+    async def stop(self):
+        if self.bot is not None and self.bot.returncode is None:
+            self.bot.terminate()
+            await self.bot.wait()
+        if self._client is not None:
+            await self._client.aclose()
+        if self.api is not None:
+            await self.api.close()
+
+    async def deliver(self, update):
+        if self.args.mode == 'webhook':
+            await self._client.post(f"http://127.0.0.1:{self.webhook_port}/telegram", json=update)
+        else:
+            self.api.push_update(update)
+
+    async def step(self, name, chat_id, update):
+        """Deliver update and wait for the bot's next message to chat_id."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[chat_id] = future
+        sent = time.perf_counter()
+        await self.deliver(update)
+        try:
+            replied = await asyncio.wait_for(future, self.args.timeout)
+        except asyncio.TimeoutError:
+            self._waiting.pop(chat_id, None)
+            self.timeouts[name] += 1
+            return False
+        self.latencies[name].append(replied - sent)
+        return True
+
+    async def think(self):
+        # ConversationHandler stores the new state only after the handler
+        # returns, which is just after its reply, so never send instantly
+        await asyncio.sleep(self.args.think_time * (0.5 + random.random()))
+
+    async def user_session(self, user_id, referrer_id):
+        start = f"/start {referrer_id}" if referrer_id else "/start"
+        name = 'start_referral' if referrer_id else 'start'
+        if not await self.step(name, user_id, self.factory.message(user_id, start)):
+            return
+        await self.think()
+        if not await self.step('check_join', user_id, self.factory.callback(user_id, callbacks.encode(callbacks.CHECK_JOIN))):
+            return
+        for button in random.sample(list(MENU_BUTTONS), k=random.randint(1, len(MENU_BUTTONS))):
+            await self.think()
+            await self.step(button, user_id, self.factory.message(user_id, MENU_BUTTONS[button]))
+
+    async def admin_broadcast(self):
+        await self.step('admin', ADMIN_ID, self.factory.message(ADMIN_ID, '/admin'))
+        await self.step('admin_broadcast', ADMIN_ID, self.factory.callback(ADMIN_ID, callbacks.encode(callbacks.BROADCAST)))
+        await self.step('broadcast', ADMIN_ID, self.factory.message(ADMIN_ID, 'Load test announcement'))
+
+    async def run_generated(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        user_ids = [100000 + i for i in range(self.args.users)]
+
+        async def session(index, user_id):
+            async with semaphore:
+                # Earlier users act as referrers for later ones
+                referrer = None
+                if index and random.random() < self.args.referral_ratio:
+                    referrer = user_ids[random.randrange(index)]
+                await self.user_session(user_id, referrer)
+
+        tasks = [session(i, user_id) for i, user_id in enumerate(user_ids)]
+        if self.args.broadcasts:
+            tasks.append(self._broadcasts_during_run())
+        await asyncio.gather(*tasks)
+
+    async def _broadcasts_during_run(self):
+        for _ in range(self.args.broadcasts):
+            await asyncio.sleep(random.random() * 2)
+            await self.admin_broadcast()
+
+    async def run_trace(self, path):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        # Updates from one chat are replayed in order, chats run concurrently
+        per_chat = defaultdict(list)
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                update = json.loads(line)
+                update = update.get('update', update)
+                if 'message' in update:
+                    chat_id, kind = update['message']['chat']['id'], 'message'
+                elif 'callback_query' in update:
+                    chat_id, kind = update['callback_query']['from']['id'], 'callback'
+                else:
+                    continue
+                per_chat[chat_id].append((kind, update))
+
+        async def replay(chat_id, updates):
+            async with semaphore:
+                for kind, update in updates:
+                    text = update.get('message', {}).get('text', '')
+                    name = text.split()[0] if text.startswith('/') else kind
+                    await self.step(name, chat_id, self.factory.renumber(update))
+
+        await asyncio.gather(*(replay(chat_id, updates) for chat_id, updates in per_chat.items()))
+
+    def report(self, elapsed):
+        handlers = {}
+        total = 0
+        for name in sorted(set(self.latencies) | set(self.timeouts)):
+            values = self.latencies[name]
+            total += len(values)
+            handlers[name] = {
+                'count': len(values),
+                'timeouts': self.timeouts[name],
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'max_ms': round(max(values) * 1000, 2) if values else 0.0,
+            }
+        return {
+            'mode': self.args.mode,
+            'workers': self.args.workers,
+            'users': self.args.users,
+            'concurrency': self.args.concurrency,
+            'api_latency_ms': self.args.api_latency * 1000,
+            'elapsed_s': round(elapsed, 3),
+            'updates': total,
+            'updates_per_s': round(total / elapsed, 2) if elapsed else 0.0,
+            'handlers': handlers,
+            'api_calls': dict(self.api.calls),
+        }
+
+def print_report(report):
+    print(
+        f"mode={report['mode']} workers={report.get('workers', 0)} updates={report['updates']} elapsed={report['elapsed_s']}s "
+        f"throughput={report['updates_per_s']} updates/s"
+    )
+    print(f"{'handler':18} {'count':>7} {'timeouts':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in report['handlers'].items():
+        print(
+            f"{name:18} {row['count']:>7} {row['timeouts']:>8} {row['p50_ms']:>9} "
+            f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}"
+        )
+    print("api calls: " + ", ".join(f"{k}={v}" for k, v in sorted(report['api_calls'].items())))
+
+def compare(report, baseline, tolerance):
+    """Return a list of regressions of report against baseline."""
+    problems = []
+    if report['updates_per_s'] < baseline['updates_per_s'] * (1 - tolerance):
+        problems.append(
+            f"throughput {report['updates_per_s']} < baseline {baseline['updates_per_s']}"
+        )
+    for name, row in report['handlers'].items():
+        old = baseline['handlers'].get(name)
+        if old and row['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name} p95 {row['p95_ms']}ms > baseline {old['p95_ms']}ms")
+        if row['timeouts'] > (old or {}).get('timeouts', 0):
+            problems.append(f"{name} timeouts {row['timeouts']}")
+    return problems
+
+async def run(args):
+    test = LoadTest(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            await test.start(workdir)
+            started = time.perf_counter()
+            if args.trace:
+                await test.run_trace(args.trace)
+            else:
+                await test.run_generated()
+            elapsed = time.perf_counter() - started
+        finally:
+            await test.stop()
+    return test.report(elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['webhook', 'polling'], default='webhook')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50, help="simultaneous user sessions")
+    parser.add_argument('--concurrent-updates', type=int, default=64, help="CONCURRENT_UPDATES for the bot")
+    parser.add_argument('--workers', type=int, default=0, help="SHARD_WORKERS for the bot")
+    parser.add_argument('--referral-ratio', type=float, default=0.7)
+    parser.add_argument('--broadcasts', type=int, default=0, help="admin broadcasts to mix into the run")
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--api-latency', type=float, default=0.03)
+    parser.add_argument('--api-jitter', type=float, default=0.01)
+    parser.add_argument('--think-time', type=float, default=0.2, help="mean pause between a user's steps")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--trace', help="JSONL file of updates to replay instead of generated traffic")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write the report to this file")
+    parser.add_argument('--baseline', help="earlier --json report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Memory and startup benchmark: dict-of-dicts vs compact User records.
+
+For each size it generates a synthetic user_data.json and, each in a fresh
+process, measures load time and resident memory for:
+
+- dict:         json.load of user_data.json, the old in-memory model
+- compact-json: storage.load_users_from_json, straight into User records
+- write-behind: WriteBehindStore startup from the migrated SQLite file;
+  referred ids are loaded lazily, so they are not in its memory figure
+
+It also times a referral membership check against the most popular
+referrer in each model; for write-behind the first check loads that
+referrer's ids, and the time is averaged over all checks. Results are printed as one JSON object per line.
+
+    python -m benchmarks.memory_bench [--sizes 10000,100000,1000000]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import tracemalloc
+import argparse
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.datagen import write_users
+
+def _load(case, json_path, db_path):
+    import storage
+    if case == 'dict':
+        users = storage.load_data(json_path)['users']
+        top = max(users, key=lambda user_id: len(users[user_id]['referrals']))
+        missing = 'nobody'
+        return users, top, lambda: missing not in users[top]['referrals'], None
+    if case == 'compact-json':
+        users = storage.load_users_from_json(json_path)['users']
+        top = max(users, key=lambda user_id: users[user_id].referral_count)
+        return users, top, lambda: users[top].has_referral(-1), None
+    store = storage.WriteBehindStore(storage.SqliteStore(db_path), journal_path=db_path + '.journal')
+    users = store._users
+    top = max(users, key=lambda user_id: users[user_id].referral_count)
+    return users, top, lambda: store.has_referral(top, -1), store
+
+def _time_membership(check, repeat=10000):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        check()
+    return (time.perf_counter() - started) / repeat
+
+def _measure(case, json_path, db_path, results):
+    # Import before measuring so module state is not counted
+    import storage  # noqa: F401
+
+    # Timed load first, then a second load under tracemalloc for memory,
+    # since tracing slows loading down
+    started = time.perf_counter()
+    users, top, check, store = _load(case, json_path, db_path)
+    elapsed = time.perf_counter() - started
+    count = len(users)
+    referrals = len(users[top]['referrals']) if case == 'dict' else users[top].referral_count
+    check_us = _time_membership(check) * 1e6
+    if store is not None:
+        store.close()
+    del users, top, check, store
+    gc.collect()
+
+    tracemalloc.start()
+    users, top, check, store = _load(case, json_path, db_path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if store is not None:
+        store.close()
+
+    results.put({
+        'case': case,
+        'users': count,
+        'load_s': round(elapsed, 4),
+        'memory_mb': round(current / 1e6, 1),
+        'peak_memory_mb': round(peak / 1e6, 1),
+        'bytes_per_user': int(current / max(1, count)),
+        'top_referrer_referrals': referrals,
+        'membership_check_us': round(check_us, 3),
+    })
+
+def run_case(case, json_path, db_path):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(case, json_path, db_path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--shape', default='power')
+    args = parser.parse_args()
+
+    import storage
+    for size in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = write_users(os.path.join(tmp, 'user_data.json'), size, args.shape)
+            db_path = os.path.join(tmp, 'bot.db')
+            store = storage.SqliteStore(db_path)
+            storage.migrate_from_json(store, json_path)
+            store.close()
+
+            for case in ('dict', 'compact-json', 'write-behind'):
+                result = run_case(case, json_path, db_path)
+                result['size'] = size
+                result['json_mb'] = round(os.path.getsize(json_path) / 1e6, 1)
+                print(json.dumps(result), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Stress the referral and withdraw paths with concurrent updates.
+
+Fires thousands of concurrent /start-with-referral updates at a single
+referrer through bot.start, double-taps Withdraw, and races several
+processes against one SQLite file. Exits non-zero if any increment is
+lost, a reward is withdrawn twice, or the /stats counters disagree with
+a full scan.
+
+    python -m benchmarks.referral_stress [--referrals 5000] [--processes 4]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from storage import SqliteStore, WriteBehindStore
+from outbound import OutboundScheduler
+from stats import Stats
+
+REFERRER_ID = 1
+
+class FakeMessage:
+    def __init__(self, text=None):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(random.random() / 1000)
+        self.replies.append(text)
+
+class FakeBot:
+    username = 'stressbot'
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        # Yield to the loop so handlers interleave the way they do live
+        await asyncio.sleep(random.random() / 1000)
+        self.sent += 1
+
+def fake_update(user_id, text=None):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, username=None),
+        message=FakeMessage(text),
+    )
+
+def fake_context(fake_bot, tenant, args=None):
+    return SimpleNamespace(bot=fake_bot, args=args or [], user_data={}, bot_data={'tenant': tenant})
+
+def _counters(stats):
+    return {name: value for name, value in vars(stats).items() if name != 'leaderboard'}
+
+async def stress_handlers(store, referrals, duplicates):
+    tenant = bot.Tenant('stress', None)
+    tenant.store = store
+    fake_bot = FakeBot()
+    bot.outbound = OutboundScheduler(fake_bot)
+    bot.outbound.start()
+    store.create_user(REFERRER_ID, 'referrer')
+    tenant.stats = Stats.from_users(store.iter_users())
+
+    updates = []
+    for i in range(referrals):
+        user_id = 1000 + i
+        for _ in range(1 + duplicates):
+            updates.append(bot.start(fake_update(user_id), fake_context(fake_bot, tenant, [str(REFERRER_ID)])))
+    random.shuffle(updates)
+
+    started = time.perf_counter()
+    await asyncio.gather(*updates)
+    elapsed = time.perf_counter() - started
+
+    withdraw_updates = [fake_update(REFERRER_ID, f"{bot.MONEY_EMOJI} Withdraw Reward") for _ in range(50)]
+    await asyncio.gather(*(bot.handle_menu_selection(u, fake_context(fake_bot, tenant)) for u in withdraw_updates))
+    withdrawals = sum(
+        1 for u in withdraw_updates for reply in u.message.replies if 'Congratulations' in reply
+    )
+    await bot.outbound.stop()
+    # The incremental counters must agree with a fresh scan
+    scanned = Stats.from_users(store.iter_users())
+    consistent = (
+        _counters(tenant.stats) == _counters(scanned)
+        and tenant.stats.leaderboard.items() == scanned.leaderboard.items()
+    )
+    return elapsed, store.get_user(REFERRER_ID).referral_count, withdrawals, consistent
+
+def _process_worker(path, start, count, results):
+    store = SqliteStore(path)
+    credited = sum(1 for user_id in range(start, start + count) if store.add_referral(REFERRER_ID, user_id))
+    withdrawn = sum(1 for _ in range(20) if store.mark_withdrawn(REFERRER_ID))
+    store.close()
+    results.put((credited, withdrawn))
+
+def stress_processes(path, referrals, processes):
+    store = SqliteStore(path)
+    store.create_user(REFERRER_ID, 'referrer')
+    # Start the stored /stats counters so the workers keep them up to date
+    store.load_stats()
+    store.close()
+
+    per_process = referrals // processes
+    results = multiprocessing.Queue()
+    workers = []
+    for p in range(processes):
+        # Every process also retries the first range, so duplicates race too
+        for start in (1000 + p * per_process, 1000):
+            workers.append(multiprocessing.Process(
+                target=_process_worker, args=(path, start, per_process, results)
+            ))
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    store = SqliteStore(path)
+    count = store.get_user(REFERRER_ID).referral_count
+    # The counters every process updated must agree with a fresh scan
+    stored, scanned = store.load_stats(), Stats.from_users(store.iter_users())
+    consistent = (
+        _counters(stored) == _counters(scanned)
+        and stored.leaderboard.items() == scanned.leaderboard.items()
+    )
+    store.close()
+    return (elapsed, count, sum(o[0] for o in outcomes), sum(o[1] for o in outcomes),
+            per_process * processes, consistent)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--referrals', type=int, default=5000)
+    parser.add_argument('--duplicates', type=int, default=1, help="extra /start updates per referred user")
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, store in (
+            ('write-behind', WriteBehindStore(SqliteStore(os.path.join(tmp, 'wb.db')))),
+            ('sqlite', SqliteStore(os.path.join(tmp, 'sqlite.db'))),
+        ):
+            elapsed, count, withdrawals, consistent = asyncio.run(
+                stress_handlers(store, args.referrals, args.duplicates)
+            )
+            store.close()
+            ok = count == args.referrals and withdrawals == 1 and consistent
+            failed |= not ok
+            print(
+                f"{name:13} {args.referrals * (1 + args.duplicates)} updates in {elapsed:.2f}s: "
+                f"referral_count={count} (expected {args.referrals}), withdrawals={withdrawals}, "
+                f"stats {'consistent' if consistent else 'inconsistent'} "
+                f"{'OK' if ok else 'FAIL'}"
+            )
+
+        elapsed, count, credited, withdrawn, expected, consistent = stress_processes(
+            os.path.join(tmp, 'multi.db'), args.referrals, args.processes
+        )
+        ok = count == expected and credited == expected and withdrawn == 1 and consistent
+        failed |= not ok
+        print(
+            f"{'processes':13} {args.processes * 2} processes in {elapsed:.2f}s: "
+            f"referral_count={count}, credited={credited} (expected {expected}), "
+            f"withdrawals={withdrawn}, stats {'consistent' if consistent else 'inconsistent'} "
+            f"{'OK' if ok else 'FAIL'}"
+        )
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Storage micro-benchmarks at increasing user counts and referral shapes.
+
+For every size and referral-graph shape it generates a user_data.json with
+benchmarks.datagen and, each in a fresh process, measures:
+
+- json:           load_data parse time, save_data write time, and the old
+                  per-referral path (load, modify, save the whole file)
+- compact-json:   load_users_from_json parse time
+- sqlite-migrate: migrate_from_json into an empty database
+- sqlite:         SqliteStore get_user and /start-with-referral latency
+- write-behind:   WriteBehindStore startup, the same operations, and the
+                  flush of everything they left pending
+
+plus ChannelConfig reload and refresh times for a channels.json of
+--channels entries. Every result carries the peak RSS of its process.
+Results are printed as one JSON object per line and, with --json, also
+written to a file as a list.
+
+    python -m benchmarks.storage_bench [--sizes 10000,100000,1000000] [--shapes none,uniform,power]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.datagen import write_users, SHAPES
+
+CASES = ('json', 'compact-json', 'sqlite-migrate', 'sqlite', 'write-behind')
+
+def _rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _latency(samples):
+    samples = sorted(samples)
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+    return {
+        'ops': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+def _referral_ops(user_ids, count, seed):
+    """(referrer, new user) pairs: existing referrers, brand new referred ids."""
+    rng = random.Random(seed)
+    first_new = max(user_ids) + 1
+    return [(rng.choice(user_ids), first_new + i) for i in range(count)]
+
+def _json_case(paths, ops, result):
+    import storage
+    parse_s, data = _timed(lambda: storage.load_data(paths['json']))
+    work = os.path.join(paths['dir'], 'work.json')
+    write_s, _ = _timed(lambda: storage.save_data(data, work))
+    user_ids = [int(user_id) for user_id in data['users']]
+    del data
+
+    samples = []
+    for referrer_id, user_id in _referral_ops(user_ids, ops, 1):
+        started = time.perf_counter()
+        data = storage.load_data(work)
+        data['users'][str(user_id)] = {
+            'username': f"user_{user_id}", 'points': 0, 'referrals': [],
+            'has_withdrawn': False, 'referred_by': str(referrer_id),
+        }
+        data['users'][str(referrer_id)]['referrals'].append(str(user_id))
+        storage.save_data(data, work)
+        samples.append(time.perf_counter() - started)
+        del data
+    os.unlink(work)
+    result.update(parse_s=round(parse_s, 4), write_s=round(write_s, 4), referral=_latency(samples))
+
+def _compact_json_case(paths, ops, result):
+    import storage
+    parse_s, data = _timed(lambda: storage.load_users_from_json(paths['json']))
+    result.update(parse_s=round(parse_s, 4))
+
+def _migrate_case(paths, ops, result):
+    import storage
+    store = storage.SqliteStore(paths['db'])
+    migrate_s, _ = _timed(lambda: storage.migrate_from_json(store, paths['json']))
+    store.close()
+    result.update(migrate_s=round(migrate_s, 4), db_mb=round(os.path.getsize(paths['db']) / 1e6, 1))
+
+def _store_ops(store, user_ids, ops):
+    lookups = []
+    rng = random.Random(2)
+    for _ in range(ops):
+        user_id = rng.choice(user_ids)
+        started = time.perf_counter()
+        store.get_user(user_id)
+        lookups.append(time.perf_counter() - started)
+
+    referrals = []
+    for referrer_id, user_id in _referral_ops(user_ids, ops, 1):
+        started = time.perf_counter()
+        store.create_user(user_id, f"user_{user_id}")
+        store.add_referral(referrer_id, user_id)
+        referrals.append(time.perf_counter() - started)
+    return {'get_user': _latency(lookups), 'referral': _latency(referrals)}
+
+def _sqlite_case(paths, ops, result):
+    import storage
+    work = os.path.join(paths['dir'], 'work.db')
+    shutil.copy(paths['db'], work)
+    store = storage.SqliteStore(work)
+    user_ids = list(store.iter_user_ids(batch_size=10000))
+    result.update(_store_ops(store, user_ids, ops))
+    store.close()
+
+def _write_behind_case(paths, ops, result):
+    import storage
+    work = os.path.join(paths['dir'], 'work.db')
+    shutil.copy(paths['db'], work)
+    startup_s, store = _timed(lambda: storage.WriteBehindStore(
+        storage.SqliteStore(work), flush_threshold=float('inf')
+    ))
+    user_ids = list(store.iter_user_ids())
+    result.update(startup_s=round(startup_s, 4))
+    result.update(_store_ops(store, user_ids, ops))
+    pending = store.pending_changes
+    flush_s, _ = _timed(lambda: asyncio.run(store.flush()))
+    result.update(flush_s=round(flush_s, 4), flushed_changes=pending)
+    store.close()
+
+def _channels_case(paths, count, result):
+    from channels import ChannelConfig
+    path = os.path.join(paths['dir'], 'channels.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'channels': [
+                {'name': f"Channel {i}", 'link': f"https://t.me/channel{i}", 'id': str(-1001000000000 - i)}
+                for i in range(count)
+            ],
+            'folders': {f"Folder {i}": {'link': f"https://t.me/addlist/{i}"} for i in range(count // 4)},
+        }, f, indent=4)
+    config = ChannelConfig(path, recheck_interval=0)
+    reloads, refreshes = [], []
+    for _ in range(1000):
+        started = time.perf_counter()
+        config.reload()
+        reloads.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        config.refresh()
+        refreshes.append(time.perf_counter() - started)
+    result.update(channels=count, reload=_latency(reloads), refresh=_latency(refreshes))
+
+RUNNERS = {
+    'json': _json_case,
+    'compact-json': _compact_json_case,
+    'sqlite-migrate': _migrate_case,
+    'sqlite': _sqlite_case,
+    'write-behind': _write_behind_case,
+    'channels': _channels_case,
+}
+
+def _measure(case, paths, ops, results):
+    import storage  # noqa: F401
+    import channels  # noqa: F401
+    result = {'case': case, 'baseline_rss_mb': round(_rss_mb(), 1)}
+    RUNNERS[case](paths, ops, result)
+    result['peak_rss_mb'] = round(_rss_mb(), 1)
+    results.put(result)
+
+def run_case(case, paths, ops):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(case, paths, ops, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def _json_ops(size, ops):
+    # The old path rewrites the whole file per referral, so keep it bounded
+    return max(3, min(ops, 500000 // size))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--shapes', default=','.join(SHAPES))
+    parser.add_argument('--cases', default=','.join(CASES))
+    parser.add_argument('--ops', type=int, default=1000, help="operations per latency measurement")
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--json', help="also write all results to this file")
+    args = parser.parse_args()
+    cases = args.cases.split(',')
+    # The SQLite cases need the migrated database
+    if 'sqlite-migrate' not in cases and {'sqlite', 'write-behind'} & set(cases):
+        cases.insert(0, 'sqlite-migrate')
+
+    results = []
+    def report(result):
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run_case('channels', {'dir': tmp}, args.channels)
+        report(result)
+
+        for size in [int(s) for s in args.sizes.split(',')]:
+            for shape in args.shapes.split(','):
+                paths = {
+                    'dir': tmp,
+                    'json': write_users(os.path.join(tmp, 'user_data.json'), size, shape),
+                    'db': os.path.join(tmp, 'bot.db'),
+                }
+                for case in cases:
+                    ops = _json_ops(size, args.ops) if case == 'json' else args.ops
+                    result = run_case(case, paths, ops)
+                    result.update(size=size, shape=shape, json_mb=round(os.path.getsize(paths['json']) / 1e6, 1))
+                    report(result)
+                for name in os.listdir(tmp):
+                    if name.startswith(('bot.db', 'work.db')):
+                        os.unlink(os.path.join(tmp, name))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
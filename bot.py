@@ -1,13 +1,34 @@
 import os
-import logging
 import json
+import time
+import signal
+import asyncio
+import tempfile
+import logging
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, TypeHandler, ContextTypes, filters, ConversationHandler
+from telegram.constants import ChatType, ChatMemberStatus
 
-# Load environment variables
+# Load environment variables before the local modules read their settings
 load_dotenv()
 
+from membership import MembershipCache
+from broadcast import BroadcastManager, BroadcastJob, broadcast_media, CAPTION_LIMIT
+from storage import SqliteStore, WriteBehindStore, migrate_from_json, replay_journals, DB_FILE
+from channels import ChannelConfig
+from webserver import HTTPServer
+from concurrency import KeyedLock, SingleFlight
+from outbound import OutboundScheduler
+from stats import Stats
+from backup import export_chunks, read_batches, FORMATS
+from persistence import SqlitePersistence
+from ratelimit import PriorityRateLimiter, FloodControl, MESSAGE_RATE
+import callbacks
+import metrics
+import sharding
+from metrics import timed_handler, InstrumentedRequest
+
 # Configure logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -17,11 +38,24 @@ logger = logging.getLogger(__name__)
 
 # Constants
 WAITING_FOR_JOIN, MAIN_MENU = range(2)
-DATA_FILE = 'user_data.json'
 CHANNELS_FILE = 'channels.json'
 SPOTIFY_CHANNEL_LINK = "https://t.me/+g-xrzWHWZcUzODA1"
 ADMIN_ID = int(os.getenv("ADMIN_ID", "6994528708"))
 
+# Serving mode: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Override to point the bot at a local fake Bot API, e.g. http://127.0.0.1:8081
+BOT_API_URL = os.getenv("BOT_API_URL")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# How many updates may be handled at the same time
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# How often a worker of sharded mode rereads the admin list
+ADMINS_RECHECK_INTERVAL = float(os.getenv("ADMINS_RECHECK_INTERVAL", "5"))
+
 # Emojis
 FIRE_EMOJI = "🔥"
 ROCKET_EMOJI = "🚀"
@@ -37,78 +71,16 @@ USER_EMOJI = "👤"
 FOLDER_EMOJI = "📁"
 BROADCAST_EMOJI = "📣"
 
-# Initialize data storage
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {'users': {}}
-
-def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-
-def load_channels():
-    if os.path.exists(CHANNELS_FILE):
-        with open(CHANNELS_FILE, 'r') as f:
-            return json.load(f)
-    return {'channels': [], 'folders': {}}
-
-def save_channels(channels_data):
-    with open(CHANNELS_FILE, 'w') as f:
-        json.dump(channels_data, f, indent=4)
+# Shared by every bot in the process; per-user keys include the bot's name
+membership_cache = MembershipCache()
+user_locks = KeyedLock()
+flood_control = FloodControl()
+join_checks = SingleFlight()
+outbound = None
+metrics_server = None
+tenants = []
 
-# Command handlers
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    user_id = str(user.id)
-    
-    data = load_data()
-    
-    # Initialize user data if not exists
-    if user_id not in data['users']:
-        data['users'][user_id] = {
-            'username': user.username if user.username else f"user_{user_id}",
-            'points': 0,
-            'referrals': [],
-            'has_withdrawn': False,
-            'referred_by': None,
-        }
-        save_data(data)
-        
-    # Check if this user was referred by someone
-    if context.args and context.args[0] != user_id:
-        referrer_id = context.args[0]
-        if referrer_id in data['users'] and user_id not in data['users'][referrer_id]['referrals']:
-            # Update referral information
-            data['users'][referrer_id]['referrals'].append(user_id)
-            data['users'][user_id]['referred_by'] = referrer_id
-            save_data(data)
-            
-            # Notify the referrer
-            try:
-                await context.bot.send_message(
-                    chat_id=int(referrer_id),
-                    text=f"{STAR_EMOJI} Great news! A new user has joined using your referral link!"
-                )
-                
-                # Check if this referral completes the requirement (3 referrals)
-                if len(data['users'][referrer_id]['referrals']) >= 3 and not data['users'][referrer_id]['has_withdrawn']:
-                    await context.bot.send_message(
-                        chat_id=int(referrer_id),
-                        text=f"{GIFT_EMOJI} Congratulations! You've referred 3 friends successfully! You can now withdraw your reward."
-                    )
-            except Exception as e:
-                logger.error(f"Failed to notify referrer: {e}")
-    
-    welcome_text = (
-        f"{FIRE_EMOJI} *Welcome to Spotify Premium Bot* {FIRE_EMOJI}\n\n"
-        f"Get FREE Spotify Premium by completing simple tasks!\n\n"
-        f"{ROCKET_EMOJI} First, join all our required channels to continue."
-    )
-    
-    # Create inline keyboard with join buttons for channels
-    channels_data = load_channels()
+def build_join_keyboard(channels_data):
     keyboard = []
     
     # Add channel buttons
@@ -124,30 +96,233 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
     
     # Add "I've Joined" button
-    keyboard.append([InlineKeyboardButton(f"{CHECK_EMOJI} I've Joined All Channels", callback_data="check_join")])
+    keyboard.append([InlineKeyboardButton(f"{CHECK_EMOJI} I've Joined All Channels", callback_data=callbacks.encode(callbacks.CHECK_JOIN))])
+    
+    return InlineKeyboardMarkup(keyboard)
+
+class Tenant:
+    """One bot token with its own users, channels, counters and broadcasts.
+
+    Handlers find it in context.bot_data['tenant'].
+    """
+
+    def __init__(self, name, token, db_path=DB_FILE, channels_path=CHANNELS_FILE, webhook_path=WEBHOOK_PATH):
+        self.name = name
+        self.token = token
+        self.db_path = db_path
+        self.webhook_path = webhook_path
+        self.store = None
+        # Channel config is read once and rebuilt only when it changes
+        self.channel_config = ChannelConfig(channels_path, build=build_join_keyboard)
+        self.stats = Stats()
+        self.broadcasts = None
+        # Set when several processes share the database
+        self.shared_store = False
+        self._admins = set()
+        self._admins_checked = 0.0
+        # Users with an admin action waiting for their next message
+        self.pending_input = filters.User()
+
+    def open_store(self, shared=False):
+        """Open the database, in memory behind a write-behind cache unless
+        other processes write to it too."""
+        backend = SqliteStore(self.db_path)
+        # user_data.json predates multi-bot mode and belongs to the default database
+        if self.db_path == DB_FILE:
+            migrate_from_json(backend)
+        self.shared_store = shared
+        if shared:
+            # Leftovers of an earlier single-process run
+            replay_journals(backend)
+            self.store = backend
+        else:
+            self.store = WriteBehindStore(backend)
+        self.reload_admins()
+        return self.store
+
+    def reload_admins(self):
+        self._admins = {int(user_id) for user_id in self.store.get_admins() if user_id.lstrip('-').isdigit()}
+        self._admins_checked = time.monotonic()
+
+    @property
+    def admins(self):
+        # Other workers can add admins too, so look again now and then
+        if self.shared_store and time.monotonic() - self._admins_checked >= ADMINS_RECHECK_INTERVAL:
+            self.reload_admins()
+        return self._admins
+
+    def add_admin(self, user_id):
+        added = self.store.add_admin(user_id)
+        self.reload_admins()
+        return added
+
+    async def start(self, bot, resume=True):
+        self.store.start()
+        if not self.shared_store:
+            # The only full scan; handlers keep the counters current from here on
+            self.stats = Stats.from_users(self.store.iter_users())
+        self.broadcasts = BroadcastManager(self.store, bot)
+        if resume:
+            self.broadcasts.resume()
+
+    async def stop(self):
+        await self.broadcasts.stop()
+        await self.store.aclose()
+
+def _namespaced(path, name):
+    root, ext = os.path.splitext(path)
+    return f"{root}-{name}{ext}"
+
+def load_tenants():
+    """A Tenant per token in BOT_TOKENS (comma-separated), else one for BOT_TOKEN.
+
+    With several tokens each bot gets its webhook at WEBHOOK_PATH/123456
+    and keeps its files apart, suffixed with its numeric id (bot-123456.db,
+    channels-123456.json). The exception is BOT_TOKEN, or the first token
+    if BOT_TOKEN isn't among them: that bot keeps bot.db and channels.json,
+    so adding tokens doesn't leave an existing bot without its data.
+    """
+    tokens = [token.strip() for token in os.getenv("BOT_TOKENS", "").split(',') if token.strip()]
+    if len(tokens) <= 1:
+        token = tokens[0] if tokens else os.getenv("BOT_TOKEN", "7440431620:AAHBjql-Cu73vsKC33ruNgy5TrVbrmCvHro")
+        return [Tenant(token.split(':', 1)[0], token)]
+    primary = os.getenv("BOT_TOKEN") if os.getenv("BOT_TOKEN") in tokens else tokens[0]
+    loaded = []
+    for token in tokens:
+        name = token.split(':', 1)[0]
+        if token == primary:
+            loaded.append(Tenant(name, token, webhook_path=f"{WEBHOOK_PATH}/{name}"))
+            continue
+        loaded.append(Tenant(
+            name, token,
+            db_path=_namespaced(DB_FILE, name),
+            channels_path=_namespaced(CHANNELS_FILE, name),
+            webhook_path=f"{WEBHOOK_PATH}/{name}",
+        ))
+    return loaded
+
+def register_gauges(applications):
+    gauge = metrics.registry.gauge
+    gauge('bot_update_queue_depth', "Updates waiting to be processed",
+          lambda: sum(application.update_queue.qsize() for application in applications))
+    gauge('bot_tenants', "Bots served by this process", lambda: len(tenants))
+    gauge('bot_users', "Known users", lambda: sum(tenant.store.user_count() for tenant in tenants))
+    gauge('bot_storage_pending_changes', "Changes not yet flushed to SQLite",
+          lambda: sum(tenant.store.pending_changes for tenant in tenants))
+    gauge('bot_membership_cache_hits', "Membership checks answered from cache", lambda: membership_cache.hits)
+    gauge('bot_membership_cache_misses', "Membership checks that needed getChatMember", lambda: membership_cache.misses)
+    gauge('bot_membership_cache_hit_ratio', "Membership cache hit ratio", lambda: membership_cache.stats()['hit_rate'])
+    gauge('bot_flood_dropped', "Updates dropped by per-user flood control", lambda: flood_control.dropped)
+    gauge('bot_broadcast_queue_depth', "Broadcast recipients queued for sending",
+          lambda: sum(tenant.broadcasts.queue_depth for tenant in tenants))
+    gauge('bot_broadcast_running', "Broadcasts currently running",
+          lambda: sum(int(tenant.broadcasts.running) for tenant in tenants))
+
+async def post_init(application: Application):
+    tenant = application.bot_data['tenant']
+    # Admin actions pending before a restart come back with user_data
+    for user_id, user_data in application.user_data.items():
+        if 'admin_action' in user_data:
+            tenant.pending_input.add_user_ids(user_id)
+    await tenant.start(application.bot, application.bot_data.get('resume', True))
+
+async def post_stop(application: Application):
+    # Broadcasts send through the bot, which Application.shutdown() closes
+    await application.bot_data['tenant'].broadcasts.stop()
+
+async def post_shutdown(application: Application):
+    await application.bot_data['tenant'].stop()
+
+def is_admin(tenant, user_id):
+    return user_id == ADMIN_ID or user_id in tenant.admins
+
+# Runs before every other handler (group -1)
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Only what users send counts; membership updates are not theirs to limit
+    if update.message is None and update.callback_query is None:
+        return
+    user = update.effective_user
+    tenant = context.bot_data['tenant']
+    # Admins are trusted, and may send many import files at once
+    if user is None or is_admin(tenant, user.id) or flood_control.allow((tenant.name, user.id)):
+        return
+    if update.callback_query:
+        # Stop the button's loading spinner; the answer itself is cheap
+        await update.callback_query.answer("Too many requests, please wait a moment.")
+    raise ApplicationHandlerStop
+
+# Command handlers
+@timed_handler
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    user = update.effective_user
+    user_id = user.id
+    
+    # Updates run concurrently; keep each user's /start handling in order
+    async with user_locks((tenant.name, user_id)):
+        # Initialize user data if not exists
+        if tenant.store.create_user(user_id, user.username if user.username else f"user_{user_id}"):
+            tenant.stats.user_created()
+        else:
+            # A user who blocked the bot and came back is reachable again
+            tenant.store.set_active(user_id, True)
+    
+        # Check if this user was referred by someone
+        if context.args and context.args[0].isdigit() and int(context.args[0]) != user_id:
+            referrer_id = int(context.args[0])
+            first_referrer = tenant.store.get_user(user_id).referred_by is None
+            referral_count = tenant.store.add_referral(referrer_id, user_id)
+            if referral_count is not None:
+                tenant.stats.referral_credited(referrer_id, referral_count, first_referrer)
+                # Notify the referrer in the background so the welcome reply isn't delayed
+                outbound.send(
+                    referrer_id,
+                    f"{STAR_EMOJI} Great news! A new user has joined using your referral link!",
+                    coalesce=True,
+                    bot=context.bot
+                )
+            
+                # Check if this referral completes the requirement (3 referrals)
+                if referral_count >= 3 and not tenant.store.get_user(referrer_id).has_withdrawn:
+                    outbound.send(
+                        referrer_id,
+                        f"{GIFT_EMOJI} Congratulations! You've referred 3 friends successfully! You can now withdraw your reward.",
+                        coalesce=True,
+                        bot=context.bot
+                    )
+    
+    welcome_text = (
+        f"{FIRE_EMOJI} *Welcome to Spotify Premium Bot* {FIRE_EMOJI}\n\n"
+        f"Get FREE Spotify Premium by completing simple tasks!\n\n"
+        f"{ROCKET_EMOJI} First, join all our required channels to continue."
+    )
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Prebuilt inline keyboard with join buttons for channels
+    tenant.channel_config.refresh()
+    reply_markup = tenant.channel_config.derived
     await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
     return WAITING_FOR_JOIN
 
+@timed_handler
 async def check_user_joined(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
     
-    channels_data = load_channels()
-    not_joined = []
+    tenant.channel_config.refresh()
+    channels_data = tenant.channel_config.data
     
-    # Check if user has joined all channels
-    for channel in channels_data['channels']:
-        channel_id = channel['id']
-        try:
-            member = await context.bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-            if member.status in ['left', 'kicked']:
-                not_joined.append(channel['name'])
-        except Exception as e:
-            logger.error(f"Error checking membership for channel {channel_id}: {e}")
-            not_joined.append(channel['name'])
+    # Check if user has joined all channels; a repeated tap while a check
+    # is running waits for that check and leaves the reply to it
+    key = (tenant.name, user_id)
+    repeated = key in join_checks
+    missing = await join_checks.run(
+        key, lambda: membership_cache.not_joined(context.bot, user_id, channels_data['channels'])
+    )
+    if repeated:
+        return WAITING_FOR_JOIN if missing else MAIN_MENU
+    not_joined = [channel['name'] for channel in missing]
     
     # If user hasn't joined all channels
     if not_joined:
@@ -180,23 +355,23 @@ async def check_user_joined(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.reply_text(instruction_text, reply_markup=reply_markup, parse_mode='Markdown')
     return MAIN_MENU
 
+@timed_handler
 async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     message_text = update.message.text
-    user_id = str(update.effective_user.id)
-    data = load_data()
+    user_id = update.effective_user.id
+    user_data = tenant.store.get_user(user_id)
     
     # Check if user exists in data
-    if user_id not in data['users']:
+    if user_data is None:
         await update.message.reply_text(
             f"Please start the bot first by clicking /start"
         )
         return MAIN_MENU
     
-    user_data = data['users'][user_id]
-    
     # Handle "My Points" button
     if message_text == f"{CHART_EMOJI} My Points":
-        referral_count = len(user_data['referrals'])
+        referral_count = user_data.referral_count
         remaining = max(0, 3 - referral_count)
         
         await update.message.reply_text(
@@ -208,8 +383,8 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Handle "Refer Friends" button
     elif message_text == f"{LINK_EMOJI} Refer Friends":
-        bot = await context.bot.get_me()
-        referral_link = f"https://t.me/{bot.username}?start={user_id}"
+        # The bot's identity is fetched once when the application initializes
+        referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
         
         await update.message.reply_text(
             f"{LINK_EMOJI} *Your Referral Link* {LINK_EMOJI}\n\n"
@@ -220,14 +395,13 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Handle "Withdraw Reward" button
     elif message_text == f"{MONEY_EMOJI} Withdraw Reward":
-        referral_count = len(user_data['referrals'])
+        referral_count = user_data.referral_count
         
         if referral_count >= 3:
-            if not user_data['has_withdrawn']:
-                # Update user data to mark as withdrawn
-                data['users'][user_id]['has_withdrawn'] = True
-                save_data(data)
-                
+            # Marking as withdrawn is a compare-and-set, so a double tap
+            # can only succeed once
+            if tenant.store.mark_withdrawn(user_id):
+                tenant.stats.withdrawn()
                 await update.message.reply_text(
                     f"{GIFT_EMOJI} *Congratulations!* {GIFT_EMOJI}\n\n"
                     f"{CHECK_EMOJI} You've successfully completed the requirements!\n\n"
@@ -251,140 +425,327 @@ async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TY
     return MAIN_MENU
 
 # Admin commands
-async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@timed_handler
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     user_id = update.effective_user.id
-    if user_id != ADMIN_ID:
-        data = load_data()
-        if str(user_id) not in data.get('admins', []):
-            await update.message.reply_text("You don't have permission to use admin commands.")
-            return
+    if not is_admin(tenant, user_id):
+        await update.message.reply_text("You don't have permission to use admin commands.")
+        return
     
-    admin_keyboard = [
-        [InlineKeyboardButton("Add Channel", callback_data="admin_add_channel"),
-         InlineKeyboardButton("Delete Channel", callback_data="admin_delete_channel")],
-        [InlineKeyboardButton("Add Folder", callback_data="admin_add_folder"),
-         InlineKeyboardButton("Delete Folder", callback_data="admin_delete_folder")],
-        [InlineKeyboardButton("Add Admin", callback_data="admin_add_admin"),
-         InlineKeyboardButton("Broadcast", callback_data="admin_broadcast")]
-    ]
+    if tenant.shared_store:
+        # Other workers change the counters too; the database keeps them
+        tenant.stats = await asyncio.get_running_loop().run_in_executor(None, tenant.store.load_stats)
+    
+    leaderboard = []
+    for rank, (referrer_id, count) in enumerate(tenant.stats.leaderboard.items(), 1):
+        referrer = tenant.store.get_user(referrer_id)
+        name = f"@{referrer.username}" if referrer and referrer.username else str(referrer_id)
+        leaderboard.append(f"{rank}. {name} - {count}")
+    
+    await update.message.reply_text(
+        f"{CHART_EMOJI} Bot Statistics {CHART_EMOJI}\n\n"
+        f"{USER_EMOJI} Users: {tenant.stats.users}\n"
+        f"{LINK_EMOJI} Joined through a referral: {tenant.stats.referred_users}\n"
+        f"{STAR_EMOJI} Referrals credited: {tenant.stats.referrals}\n"
+        f"{ROCKET_EMOJI} Users who referred someone: {tenant.stats.referrers}\n"
+        f"{GIFT_EMOJI} Reached 3 referrals: {tenant.stats.reached_goal}\n"
+        f"{MONEY_EMOJI} Rewards withdrawn: {tenant.stats.withdrawals}\n\n"
+        f"{FIRE_EMOJI} Top referrers:\n" + ("\n".join(leaderboard) or "No referrals yet.")
+    )
+
+@timed_handler
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    user_id = update.effective_user.id
+    if not is_admin(tenant, user_id):
+        await update.message.reply_text("You don't have permission to use admin commands.")
+        return
+    
+    fmt = context.args[0].lower() if context.args else 'jsonl'
+    if fmt not in FORMATS:
+        await update.message.reply_text(f"Usage: /export [{'|'.join(FORMATS)}]")
+        return
+    
+    await update.message.reply_text("Exporting users...")
+    # Each chunk is sent and deleted before the next one is written; the
+    # writing happens in a worker thread so other updates keep running
+    loop = asyncio.get_running_loop()
+    total = 0
+    with tempfile.TemporaryDirectory() as directory:
+        chunks = export_chunks(tenant.store, directory, fmt)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            path, count = chunk
+            with open(path, 'rb') as f:
+                await update.message.reply_document(f, filename=os.path.basename(path), caption=f"{count} users")
+            os.unlink(path)
+            total += count
+    await update.message.reply_text(f"{CHECK_EMOJI} Export finished: {total} users.")
+
+@timed_handler
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    user_id = update.effective_user.id
+    if not is_admin(tenant, user_id):
+        await update.message.reply_text("You don't have permission to use admin commands.")
+        return
+    
+    await update.message.reply_text(
+        "Send the export files (.jsonl or .csv) as documents.\n"
+        "Send any text message when you are done."
+    )
+    set_admin_action(context, tenant, user_id, 'import')
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant):
+    document = update.message.document
+    count = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(document.file_name or 'users.jsonl'))
+        telegram_file = await context.bot.get_file(document.file_id)
+        await telegram_file.download_to_drive(path)
+        # Parsing runs in a worker thread; the store is only changed here
+        loop = asyncio.get_running_loop()
+        batches = read_batches(path)
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, next, batches, None)
+                if batch is None:
+                    break
+                tenant.store.import_users(batch)
+                count += len(batch)
+        except (ValueError, KeyError) as e:
+            await update.message.reply_text(f"Import stopped after {count} users: {e}")
+            return
+        finally:
+            # Imported records replace users wholesale, so recount once
+            tenant.stats = await loop.run_in_executor(None, tenant.store.load_stats)
+    await update.message.reply_text(f"{CHECK_EMOJI} Imported {count} users from {document.file_name}.")
+
+@timed_handler
+async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    user_id = update.effective_user.id
+    if not is_admin(tenant, user_id):
+        await update.message.reply_text("You don't have permission to use admin commands.")
+        return
     
-    reply_markup = InlineKeyboardMarkup(admin_keyboard)
     await update.message.reply_text(
         f"{STAR_EMOJI} *Admin Panel* {STAR_EMOJI}\n\n"
         f"Select an action from below:",
-        reply_markup=reply_markup,
+        reply_markup=ADMIN_KEYBOARD,
         parse_mode='Markdown'
     )
 
+def set_admin_action(context, tenant, user_id, action):
+    context.user_data['admin_action'] = action
+    # Only users in this filter reach handle_admin_input
+    tenant.pending_input.add_user_ids(user_id)
+
+def clear_admin_action(context, tenant, user_id):
+    context.user_data.pop('admin_action', None)
+    tenant.pending_input.remove_user_ids(user_id)
+
+async def ask_channel_details(query, context, tenant, argument):
+    await query.message.reply_text(
+        "Please enter the channel details in this format:\n"
+        "name|link|channel_id\n\n"
+        "Example: My Channel|https://t.me/mychannel|-1001234567890"
+    )
+    set_admin_action(context, tenant, query.from_user.id, 'add_channel')
+
+async def ask_folder_details(query, context, tenant, argument):
+    await query.message.reply_text(
+        "Please enter the folder details in this format:\n"
+        "folder_name|folder_link\n\n"
+        "Example: My Folder|https://t.me/addlist/abcde"
+    )
+    set_admin_action(context, tenant, query.from_user.id, 'add_folder')
+
+async def ask_admin_id(query, context, tenant, argument):
+    await query.message.reply_text(
+        "Please enter the user ID of the new admin:"
+    )
+    set_admin_action(context, tenant, query.from_user.id, 'add_admin')
+
+async def list_channels(query, context, tenant, argument):
+    channels_data = tenant.channel_config.data
+    if not channels_data['channels']:
+        await query.message.reply_text("No channels found.")
+        return
+    
+    channel_keyboard = []
+    for i, channel in enumerate(channels_data['channels']):
+        channel_keyboard.append([
+            InlineKeyboardButton(
+                channel['name'], 
+                callback_data=callbacks.encode(callbacks.DELETE_CHANNEL, i)
+            )
+        ])
+    
+    reply_markup = InlineKeyboardMarkup(channel_keyboard)
+    await query.message.reply_text(
+        "Select a channel to delete:",
+        reply_markup=reply_markup
+    )
+
+async def list_folders(query, context, tenant, argument):
+    channels_data = tenant.channel_config.data
+    if not channels_data['folders']:
+        await query.message.reply_text("No folders found.")
+        return
+    
+    # Folder names can be longer than callback data allows, so buttons
+    # carry the folder's position
+    folder_keyboard = []
+    for i, folder_name in enumerate(channels_data['folders']):
+        folder_keyboard.append([
+            InlineKeyboardButton(
+                folder_name, 
+                callback_data=callbacks.encode(callbacks.DELETE_FOLDER, i)
+            )
+        ])
+    
+    reply_markup = InlineKeyboardMarkup(folder_keyboard)
+    await query.message.reply_text(
+        "Select a folder to delete:",
+        reply_markup=reply_markup
+    )
+
+async def ask_broadcast(query, context, tenant, argument):
+    await query.message.reply_text(
+        "Please enter the message you want to broadcast to all users.\n"
+        "You can also send a photo, video or document with a caption."
+    )
+    set_admin_action(context, tenant, query.from_user.id, 'broadcast')
+
+async def repeat_broadcast(query, context, tenant, argument):
+    # Media goes out again under the file_id it was first sent with
+    last = tenant.broadcasts.last_job()
+    if last is None:
+        await query.message.reply_text("There is no broadcast to repeat yet.")
+        return
+    await start_broadcast(tenant, query.message, last.text, last.media_type, last.media)
+
+def _position(argument, items):
+    index = int(argument) if argument and argument.isdigit() else -1
+    return index if index < len(items) else -1
+
+async def delete_channel(query, context, tenant, argument):
+    channels_data = tenant.channel_config.edit()
+    index = _position(argument, channels_data['channels'])
+    if index < 0:
+        await query.message.reply_text("That channel no longer exists.")
+        return
+    channel = channels_data['channels'].pop(index)
+    tenant.channel_config.save(channels_data)
+    membership_cache.forget_channel(channel['id'])
+    await query.message.reply_text(f"Channel '{channel['name']}' has been deleted.")
+
+async def delete_folder(query, context, tenant, argument):
+    channels_data = tenant.channel_config.edit()
+    folder_names = list(channels_data['folders'])
+    index = _position(argument, folder_names)
+    if index < 0:
+        await query.message.reply_text("That folder no longer exists.")
+        return
+    folder_name = folder_names[index]
+    del channels_data['folders'][folder_name]
+    tenant.channel_config.save(channels_data)
+    await query.message.reply_text(f"Folder '{folder_name}' has been deleted.")
+
+ADMIN_CALLBACKS = {
+    callbacks.ADD_CHANNEL: ask_channel_details,
+    callbacks.ADD_FOLDER: ask_folder_details,
+    callbacks.ADD_ADMIN: ask_admin_id,
+    callbacks.LIST_CHANNELS: list_channels,
+    callbacks.LIST_FOLDERS: list_folders,
+    callbacks.BROADCAST: ask_broadcast,
+    callbacks.REBROADCAST: repeat_broadcast,
+    callbacks.DELETE_CHANNEL: delete_channel,
+    callbacks.DELETE_FOLDER: delete_folder,
+}
+
+ADMIN_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Add Channel", callback_data=callbacks.encode(callbacks.ADD_CHANNEL)),
+     InlineKeyboardButton("Delete Channel", callback_data=callbacks.encode(callbacks.LIST_CHANNELS))],
+    [InlineKeyboardButton("Add Folder", callback_data=callbacks.encode(callbacks.ADD_FOLDER)),
+     InlineKeyboardButton("Delete Folder", callback_data=callbacks.encode(callbacks.LIST_FOLDERS))],
+    [InlineKeyboardButton("Add Admin", callback_data=callbacks.encode(callbacks.ADD_ADMIN)),
+     InlineKeyboardButton("Broadcast", callback_data=callbacks.encode(callbacks.BROADCAST))],
+    [InlineKeyboardButton("Repeat Last Broadcast", callback_data=callbacks.encode(callbacks.REBROADCAST))]
+])
+
+# Every callback query the conversation doesn't take ends up here
+@timed_handler
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user_id = query.from_user.id
+    action, argument = callbacks.decode(query.data)
+    handler = ADMIN_CALLBACKS.get(action)
+    if handler is None:
+        # Expired buttons, or "I've Joined" pressed outside the join step
+        return
     
+    tenant = context.bot_data['tenant']
     # Verify admin
-    if user_id != ADMIN_ID:
-        data = load_data()
-        if str(user_id) not in data.get('admins', []):
-            await query.message.reply_text("You don't have permission to use admin commands.")
-            return
-    
-    action = query.data.split('_', 2)[1]
-    
-    if action == "add":
-        subcmd = query.data.split('_', 2)[2]
-        if subcmd == "channel":
-            await query.message.reply_text(
-                "Please enter the channel details in this format:\n"
-                "name|link|channel_id\n\n"
-                "Example: My Channel|https://t.me/mychannel|-1001234567890"
-            )
-            context.user_data['admin_action'] = 'add_channel'
-        elif subcmd == "folder":
-            await query.message.reply_text(
-                "Please enter the folder details in this format:\n"
-                "folder_name|folder_link\n\n"
-                "Example: My Folder|https://t.me/addlist/abcde"
-            )
-            context.user_data['admin_action'] = 'add_folder'
-        elif subcmd == "admin":
-            await query.message.reply_text(
-                "Please enter the user ID of the new admin:"
-            )
-            context.user_data['admin_action'] = 'add_admin'
-    elif action == "delete":
-        subcmd = query.data.split('_', 2)[2]
-        if subcmd == "channel":
-            channels_data = load_channels()
-            if not channels_data['channels']:
-                await query.message.reply_text("No channels found.")
-                return
-            
-            channel_keyboard = []
-            for i, channel in enumerate(channels_data['channels']):
-                channel_keyboard.append([
-                    InlineKeyboardButton(
-                        channel['name'], 
-                        callback_data=f"del_channel_{i}"
-                    )
-                ])
-            
-            reply_markup = InlineKeyboardMarkup(channel_keyboard)
-            await query.message.reply_text(
-                "Select a channel to delete:",
-                reply_markup=reply_markup
-            )
-        elif subcmd == "folder":
-            channels_data = load_channels()
-            if not channels_data['folders']:
-                await query.message.reply_text("No folders found.")
-                return
-            
-            folder_keyboard = []
-            for folder_name in channels_data['folders']:
-                folder_keyboard.append([
-                    InlineKeyboardButton(
-                        folder_name, 
-                        callback_data=f"del_folder_{folder_name}"
-                    )
-                ])
-            
-            reply_markup = InlineKeyboardMarkup(folder_keyboard)
-            await query.message.reply_text(
-                "Select a folder to delete:",
-                reply_markup=reply_markup
-            )
-    elif action == "broadcast":
-        await query.message.reply_text(
-            "Please enter the message you want to broadcast to all users:"
-        )
-        context.user_data['admin_action'] = 'broadcast'
+    if not is_admin(tenant, query.from_user.id):
+        await query.message.reply_text("You don't have permission to use admin commands.")
+        return
+    await handler(query, context, tenant, argument)
 
+async def start_broadcast(tenant, message, text, media_type=None, media=None):
+    if tenant.broadcasts.running:
+        await message.reply_text("A broadcast is already running, please wait for it to finish.")
+        return
+    # Runs in the background and edits this message with its progress
+    status_message = await message.reply_text("Broadcasting message to all users...")
+    tenant.broadcasts.start(BroadcastJob(
+        text=text,
+        admin_chat_id=status_message.chat_id,
+        status_message_id=status_message.message_id,
+        total=tenant.store.user_count(active_only=True),
+        media_type=media_type,
+        media=media,
+    ))
+
+@timed_handler
 async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'admin_action' not in context.user_data:
         return
+    tenant = context.bot_data['tenant']
     
     user_id = update.effective_user.id
     # Verify admin
-    if user_id != ADMIN_ID:
-        data = load_data()
-        if str(user_id) not in data.get('admins', []):
-            await update.message.reply_text("You don't have permission to use admin commands.")
-            return
+    if not is_admin(tenant, user_id):
+        clear_admin_action(context, tenant, user_id)
+        await update.message.reply_text("You don't have permission to use admin commands.")
+        return
     
     action = context.user_data['admin_action']
     text = update.message.text
     
+    if action == 'import' and update.message.document:
+        # More files may follow, so the action stays pending
+        await import_document(update, context, tenant)
+        return
+    if text is None and action != 'broadcast':
+        await update.message.reply_text("Please send this as a text message.")
+        return
+    
     if action == 'add_channel':
         try:
             name, link, channel_id = text.strip().split('|')
             
-            channels_data = load_channels()
+            channels_data = tenant.channel_config.edit()
             channels_data['channels'].append({
                 'name': name.strip(),
                 'link': link.strip(),
                 'id': channel_id.strip()
             })
-            save_channels(channels_data)
+            tenant.channel_config.save(channels_data)
             
             await update.message.reply_text(f"Channel '{name}' added successfully!")
         except ValueError:
@@ -396,11 +757,11 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         try:
             folder_name, folder_link = text.strip().split('|')
             
-            channels_data = load_channels()
+            channels_data = tenant.channel_config.edit()
             channels_data['folders'][folder_name.strip()] = {
                 'link': folder_link.strip()
             }
-            save_channels(channels_data)
+            tenant.channel_config.save(channels_data)
             
             await update.message.reply_text(f"Folder '{folder_name}' added successfully!")
         except ValueError:
@@ -412,87 +773,85 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         try:
             new_admin_id = text.strip()
             
-            data = load_data()
-            if 'admins' not in data:
-                data['admins'] = []
-            
-            if new_admin_id not in data['admins']:
-                data['admins'].append(new_admin_id)
-                save_data(data)
+            if tenant.add_admin(new_admin_id):
                 await update.message.reply_text(f"Admin added successfully with ID: {new_admin_id}")
             else:
                 await update.message.reply_text(f"This ID is already an admin.")
         except Exception as e:
             await update.message.reply_text(f"Error adding admin: {str(e)}")
     
+    elif action == 'import':
+        await update.message.reply_text("Import finished.")
+    
     elif action == 'broadcast':
-        data = load_data()
-        broadcast_message = text
-        success_count = 0
-        fail_count = 0
-        
-        await update.message.reply_text("Broadcasting message to all users...")
-        
-        for user_id in data['users']:
-            try:
-                await context.bot.send_message(
-                    chat_id=int(user_id),
-                    text=f"{BROADCAST_EMOJI} *ANNOUNCEMENT* {BROADCAST_EMOJI}\n\n{broadcast_message}",
-                    parse_mode='Markdown'
-                )
-                success_count += 1
-            except Exception:
-                fail_count += 1
+        # A photo, video or document is sent on by its file_id, with its
+        # caption as the message
+        media_type, media = broadcast_media(update.message)
+        broadcast_message = text or update.message.caption
+        broadcast_text = f"{BROADCAST_EMOJI} *ANNOUNCEMENT* {BROADCAST_EMOJI}"
+        if broadcast_message:
+            broadcast_text += f"\n\n{broadcast_message}"
         
-        await update.message.reply_text(
-            f"Broadcast completed!\n"
-            f"✅ Successfully sent: {success_count}\n"
-            f"❌ Failed: {fail_count}"
-        )
+        if media_type and len(broadcast_text) > CAPTION_LIMIT:
+            await update.message.reply_text(
+                f"Captions can be at most {CAPTION_LIMIT} characters, please send a shorter one."
+            )
+            return
+        await start_broadcast(tenant, update.message, broadcast_text, media_type, media)
     
     # Clear admin action
-    context.user_data.pop('admin_action', None)
+    clear_admin_action(context, tenant, user_id)
 
-async def handle_channel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    # Verify admin
-    if user_id != ADMIN_ID:
-        data = load_data()
-        if str(user_id) not in data.get('admins', []):
-            await query.message.reply_text("You don't have permission to use admin commands.")
-            return
-    
-    # Extract channel index
-    _, entity_type, entity_id = query.data.split('_', 2)
-    channels_data = load_channels()
-    
-    if entity_type == 'channel':
-        index = int(entity_id)
-        channel_name = channels_data['channels'][index]['name']
-        del channels_data['channels'][index]
-        save_channels(channels_data)
-        await query.message.reply_text(f"Channel '{channel_name}' has been deleted.")
-    
-    elif entity_type == 'folder':
-        folder_name = entity_id
-        del channels_data['folders'][folder_name]
-        save_channels(channels_data)
-        await query.message.reply_text(f"Folder '{folder_name}' has been deleted.")
+@timed_handler
+async def track_channel_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Only delivered for chats where the bot is admin
+    change = update.chat_member
+    membership_cache.record_status(
+        change.chat.id, change.new_chat_member.user.id, change.new_chat_member.status
+    )
 
-def main():
-    # Set up application with the bot token
-    token = os.getenv("BOT_TOKEN", "7440431620:AAHBjql-Cu73vsKC33ruNgy5TrVbrmCvHro")
-    application = Application.builder().token(token).build()
+@timed_handler
+async def track_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    # Users blocking or unblocking the bot in their private chat
+    change = update.my_chat_member
+    if change.chat.type != ChatType.PRIVATE:
+        return
+    status = change.new_chat_member.status
+    if status == ChatMemberStatus.BANNED:
+        tenant.store.set_active(change.chat.id, False)
+    elif status == ChatMemberStatus.MEMBER:
+        tenant.store.set_active(change.chat.id, True)
+
+def build_application(tenant, rate=MESSAGE_RATE):
+    builder = (
+        Application.builder()
+        .token(tenant.token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .concurrent_updates(CONCURRENT_UPDATES)
+        # Telegram's limits are per bot, so every token gets its own limiter
+        .rate_limiter(PriorityRateLimiter(rate))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        # Conversation states and pending admin actions survive restarts
+        .persistence(SqlitePersistence(tenant.db_path))
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    if BOT_MODE == 'webhook':
+        # Updates arrive through our own HTTP server instead of getUpdates
+        builder = builder.updater(None)
+    application = builder.build()
+    application.bot_data['tenant'] = tenant
     
     # Create conversation handler
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             WAITING_FOR_JOIN: [
-                CallbackQueryHandler(check_user_joined, pattern="^check_join$"),
+                CallbackQueryHandler(check_user_joined, pattern=callbacks.is_action(callbacks.CHECK_JOIN)),
             ],
             MAIN_MENU: [
                 MessageHandler(
@@ -502,25 +861,137 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("start", start)],
+        name="main",
+        persistent=True,
     )
     
     # Add handlers
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("admin", admin_command))
-    application.add_handler(CallbackQueryHandler(admin_callback, pattern="^admin_"))
-    application.add_handler(CallbackQueryHandler(handle_channel_delete, pattern="^del_"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_input))
-    
-    # Start the Bot
-    print("Bot is running...")
-    application.run_polling()
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CallbackQueryHandler(admin_callback))
+    application.add_handler(MessageHandler(
+        tenant.pending_input & ((filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VIDEO | filters.Document.ALL),
+        handle_admin_input
+    ))
+    application.add_handler(ChatMemberHandler(track_channel_members, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(track_bot_status, ChatMemberHandler.MY_CHAT_MEMBER))
+    return application
+
+def webhook_route(application, secret=WEBHOOK_SECRET):
+    async def receive_update(request):
+        if secret and request.headers.get('x-telegram-bot-api-secret-token') != secret:
+            return 403, 'text/plain', b'forbidden'
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return 400, 'text/plain', b'bad request'
+        # The front process of sharded mode forwards lists of updates; one
+        # that doesn't parse is skipped so the rest of the batch still runs
+        for item in data if isinstance(data, list) else [data]:
+            try:
+                update = Update.de_json(item, application.bot)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                logger.warning(f"Skipping malformed update: {e}")
+                continue
+            # Hand off to the application and answer straight away
+            await application.update_queue.put(update)
+        return 200, 'text/plain', b'ok'
+    return receive_update
+
+async def run(applications, webhook=BOT_MODE == 'webhook', listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+              webhook_url=WEBHOOK_URL, secret=WEBHOOK_SECRET, metrics_port=metrics.METRICS_PORT):
+    """Serve every application on this event loop until SIGINT or SIGTERM."""
+    global outbound, metrics_server
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    outbound = OutboundScheduler()
+    outbound.start()
+    for application in applications:
+        await application.initialize()
+        await application.post_init(application)
+    register_gauges(applications)
+    metrics_server = await metrics.start_server(metrics_port)
+
+    server = None
+    if webhook:
+        routes = {
+            ('POST', application.bot_data['tenant'].webhook_path): webhook_route(application, secret)
+            for application in applications
+        }
+        server = await HTTPServer(routes).start(listen, port)
+    for application in applications:
+        if webhook:
+            if webhook_url:
+                await application.bot.set_webhook(
+                    url=webhook_url + application.bot_data['tenant'].webhook_path,
+                    secret_token=secret,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=min(100, max(1, CONCURRENT_UPDATES)),
+                )
+        else:
+            # chat_member updates are not sent unless asked for explicitly
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await application.start()
+    print(f"Bot is running ({'webhook' if webhook else 'polling'}, {len(applications)} bot(s))...")
+    try:
+        await stop.wait()
+    finally:
+        if server is not None:
+            await server.close()
+        for application in applications:
+            if application.updater is not None and application.updater.running:
+                await application.updater.stop()
+            await application.stop()
+            await application.post_stop(application)
+            await application.shutdown()
+            await application.post_shutdown(application)
+        await outbound.stop()
+        if metrics_server is not None:
+            await metrics_server.close()
+
+def run_worker(index, workers):
+    """One worker of sharded mode: serves the users the front routes to it."""
+    tenants.extend(load_tenants())
+    applications = []
+    for tenant in tenants:
+        tenant.open_store(shared=True)
+        # Telegram's limits are per token, so the workers split them
+        application = build_application(tenant, rate=MESSAGE_RATE / workers)
+        # A broadcast cut off by a restart is picked up by one worker only
+        application.bot_data['resume'] = index == 0
+        applications.append(application)
+    metrics_port = int(metrics.METRICS_PORT) + 1 + index if metrics.METRICS_PORT else None
+    asyncio.run(run(
+        applications, webhook=True, listen='127.0.0.1', port=sharding.WORKER_PORT + index,
+        webhook_url=None, secret=None, metrics_port=metrics_port,
+    ))
+
+def main():
+    tenants.extend(load_tenants())
+    for tenant in tenants:
+        # Create data files if they don't exist
+        tenant.open_store(shared=sharding.SHARD_WORKERS > 0)
+        if not tenant.channel_config.exists():
+            tenant.channel_config.save({'channels': [], 'folders': {}})
+    if sharding.SHARD_WORKERS > 0:
+        # The workers open the databases themselves
+        for tenant in tenants:
+            tenant.store.close()
+        asyncio.run(sharding.serve(
+            [(tenant.token, tenant.webhook_path) for tenant in tenants], run_worker,
+            workers=sharding.SHARD_WORKERS, mode=BOT_MODE,
+            api_url=BOT_API_URL or "https://api.telegram.org",
+            listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, webhook_url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+        ))
+        return
+    asyncio.run(run([build_application(tenant) for tenant in tenants]))
 
 if __name__ == '__main__':
-    # Create data files if they don't exist
-    if not os.path.exists(DATA_FILE):
-        save_data({'users': {}})
-    
-    if not os.path.exists(CHANNELS_FILE):
-        save_channels({'channels': [], 'folders': {}})
-        
-    main()
\ No newline at end of file
+    main()
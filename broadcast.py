@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from telegram.error import Forbidden, BadRequest, NetworkError
+from ratelimit import BULK
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+PROGRESS_INTERVAL = 3.0
+CHECKPOINT_INTERVAL = 2.0
+CHECKPOINT_KEY = 'broadcast_checkpoint'
+LAST_BROADCAST_KEY = 'last_broadcast'
+# Telegram's limit for photo, video and document captions
+CAPTION_LIMIT = 1024
+# Longest wait between retries of a send that failed on the network
+RETRY_MAX_DELAY = 60
+
+def is_permanent_failure(error):
+    """True for send errors that will fail the same way every time: the user
+    blocked the bot or deleted their account, or the chat is gone."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and 'chat not found' in error.message.lower()
+
+def is_transient_failure(error):
+    """True for send errors where the message wasn't delivered but may be
+    on a later try: timeouts and connection errors."""
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+def broadcast_media(message):
+    """(media type, file_id) of a photo, video or document message, else (None, None)."""
+    if message.photo:
+        # The largest size; Telegram scales it down for each client
+        return 'photo', message.photo[-1].file_id
+    if message.video:
+        return 'video', message.video.file_id
+    if message.document:
+        return 'document', message.document.file_id
+    return None, None
+
+class BroadcastJob:
+    """One broadcast and its progress. With media_type set, media is the
+    file_id of a photo, video or document and text is its caption."""
+
+    def __init__(self, text, admin_chat_id, status_message_id, total,
+                 cursor=None, success_count=0, fail_count=0, parse_mode='Markdown', deactivated=0,
+                 media_type=None, media=None):
+        self.text = text
+        self.admin_chat_id = admin_chat_id
+        self.status_message_id = status_message_id
+        self.total = total
+        self.cursor = cursor
+        self.success_count = success_count
+        self.fail_count = fail_count
+        self.parse_mode = parse_mode
+        self.deactivated = deactivated
+        self.media_type = media_type
+        self.media = media
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+    @classmethod
+    def from_json(cls, raw):
+        return cls(**json.loads(raw))
+
+class BroadcastManager:
+    """Runs one broadcast at a time in the background.
+
+    Active recipients are read from the store in ascending id order and sent by
+    BROADCAST_CONCURRENCY workers at bulk priority, so the bot's
+    PriorityRateLimiter paces them behind interactive replies and handles
+    RetryAfter. The highest id
+    below which every send has completed is checkpointed in the store's
+    meta table, so a broadcast cut off by a restart resumes from there.
+    Recipients who fail permanently are marked inactive so later
+    broadcasts skip them; sends that fail on the network are retried, so
+    the checkpoint never moves past someone who wasn't sent to.
+
+    Media is sent by file_id: the file the admin sent is already on
+    Telegram's servers, so nothing is uploaded per recipient, and the id
+    is kept in the checkpoint and the last broadcast for resumes and
+    repeats.
+    """
+
+    def __init__(self, store, bot, concurrency=BROADCAST_CONCURRENCY):
+        self.store = store
+        self.bot = bot
+        self.concurrency = concurrency
+        self.job = None
+        self._task = None
+        self._queue = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, job):
+        self.job = job
+        self._save_checkpoint()
+        if job.cursor is None:
+            self.store.set_meta(LAST_BROADCAST_KEY, job.to_json())
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    def resume(self):
+        """Pick up a broadcast interrupted by a restart, if there is one."""
+        raw = self.store.get_meta(CHECKPOINT_KEY)
+        if not raw:
+            return None
+        job = BroadcastJob.from_json(raw)
+        logger.info(f"Resuming broadcast after user {job.cursor}")
+        return self.start(job)
+
+    def last_job(self):
+        """The most recently started broadcast, for sending it again."""
+        raw = self.store.get_meta(LAST_BROADCAST_KEY)
+        return BroadcastJob.from_json(raw) if raw else None
+
+    def _save_checkpoint(self):
+        self.store.set_meta(CHECKPOINT_KEY, self.job.to_json())
+
+    async def _send(self, user_id):
+        delay = 1
+        while True:
+            try:
+                await self._send_once(user_id)
+                return True
+            except Exception as e:
+                if not is_transient_failure(e):
+                    if is_permanent_failure(e) and self.store.set_active(user_id, False):
+                        self.job.deactivated += 1
+                    return False
+                logger.warning(f"Broadcast to {user_id} failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    async def _send_once(self, user_id):
+        if self.job.media_type:
+            send = getattr(self.bot, f"send_{self.job.media_type}")
+            await send(
+                user_id,
+                self.job.media,
+                caption=self.job.text,
+                parse_mode=self.job.parse_mode,
+                rate_limit_args={'priority': BULK},
+            )
+        else:
+            await self.bot.send_message(
+                chat_id=user_id,
+                text=self.job.text,
+                parse_mode=self.job.parse_mode,
+                rate_limit_args={'priority': BULK},
+            )
+
+    async def _worker(self, queue, results):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            results[user_id] = await self._send(user_id)
+            self._advance(results)
+
+    def _advance(self, results):
+        # Move the cursor past every leading recipient that has finished
+        while self._dispatched and self._dispatched[0] in results:
+            user_id = self._dispatched.popleft()
+            if results.pop(user_id):
+                self.job.success_count += 1
+            else:
+                self.job.fail_count += 1
+            self.job.cursor = user_id
+
+    async def _report(self, text):
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.job.admin_chat_id,
+                message_id=self.job.status_message_id,
+                text=text,
+                rate_limit_args={'priority': BULK},
+            )
+        except Exception as e:
+            logger.warning(f"Failed to update broadcast status: {e}")
+
+    def _progress_text(self):
+        done = self.job.success_count + self.job.fail_count
+        return (
+            f"Broadcasting message to all users...\n"
+            f"{done}/{self.job.total}\n"
+            f"✅ Successfully sent: {self.job.success_count}\n"
+            f"❌ Failed: {self.job.fail_count}"
+        )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results = {}
+        self._dispatched = deque()
+        workers = [loop.create_task(self._worker(queue, results)) for _ in range(self.concurrency)]
+
+        last_progress = last_checkpoint = time.monotonic()
+        try:
+            for user_id in self.store.iter_user_ids(after=self.job.cursor, active_only=True):
+                self._dispatched.append(user_id)
+                await queue.put(user_id)
+
+                now = time.monotonic()
+                if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    last_checkpoint = now
+                    await loop.run_in_executor(None, self._save_checkpoint)
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    await self._report(self._progress_text())
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for worker in workers:
+                worker.cancel()
+            # Keep the checkpoint so the next start resumes
+            self._save_checkpoint()
+            raise
+
+        self.store.set_meta(CHECKPOINT_KEY, '')
+        await self._report(
+            f"Broadcast completed!\n"
+            f"✅ Successfully sent: {self.job.success_count}\n"
+            f"❌ Failed: {self.job.fail_count}\n"
+            f"🚫 No longer reachable: {self.job.deactivated}"
+        )
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
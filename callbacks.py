@@ -0,0 +1,55 @@
+"""Compact, versioned callback_data for inline buttons.
+
+Buttons carry "<version>:<action>[:<argument>]", e.g. "1:dc:3" to delete
+channel 3. Telegram allows 64 bytes of callback_data, so actions are
+short codes and arguments are indexes rather than names. Data from an
+older version, or in the original "check_join" / "admin_..." format,
+decodes to the closest current action or to None.
+"""
+
+VERSION = '1'
+SEP = ':'
+
+# Actions
+CHECK_JOIN = 'j'
+ADD_CHANNEL = 'ac'
+ADD_FOLDER = 'af'
+ADD_ADMIN = 'aa'
+LIST_CHANNELS = 'lc'
+LIST_FOLDERS = 'lf'
+BROADCAST = 'b'
+REBROADCAST = 'rb'
+DELETE_CHANNEL = 'dc'
+DELETE_FOLDER = 'df'
+
+# Buttons sent before callback data was versioned; delete buttons pointed
+# at names or indexes that may have moved since, so they are dropped
+LEGACY = {
+    'check_join': CHECK_JOIN,
+    'admin_add_channel': ADD_CHANNEL,
+    'admin_add_folder': ADD_FOLDER,
+    'admin_add_admin': ADD_ADMIN,
+    'admin_delete_channel': LIST_CHANNELS,
+    'admin_delete_folder': LIST_FOLDERS,
+    'admin_broadcast': BROADCAST,
+    'admin_rebroadcast': REBROADCAST,
+}
+
+def encode(action, argument=None):
+    if argument is None:
+        return f"{VERSION}{SEP}{action}"
+    return f"{VERSION}{SEP}{action}{SEP}{argument}"
+
+def decode(data):
+    """(action, argument or None) for callback data; action is None if unknown."""
+    version, sep, rest = (data or '').partition(SEP)
+    if not sep:
+        return LEGACY.get(data), None
+    if version != VERSION:
+        return None, None
+    action, _, argument = rest.partition(SEP)
+    return action, argument or None
+
+def is_action(action):
+    """A CallbackQueryHandler pattern matching one action."""
+    return lambda data: decode(data)[0] == action
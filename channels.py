@@ -0,0 +1,75 @@
+import os
+import copy
+import json
+import time
+import logging
+
+from storage import atomic_write_json
+from metrics import storage_seconds
+
+logger = logging.getLogger(__name__)
+
+# How often the hot path may stat the file to notice edits made by hand
+RECHECK_INTERVAL = float(os.getenv("CHANNELS_RECHECK_INTERVAL", "5"))
+
+def _empty():
+    return {'channels': [], 'folders': {}}
+
+class ChannelConfig:
+    """channels.json held in memory.
+
+    The parsed config and anything derived from it (see the build argument)
+    are rebuilt only when save() is called or the file's mtime changes.
+    """
+
+    def __init__(self, path, build=None, recheck_interval=RECHECK_INTERVAL):
+        self.path = path
+        self.build = build
+        self.recheck_interval = recheck_interval
+        self.data = _empty()
+        self.derived = None
+        self._mtime = None
+        self._checked = 0.0
+        self.reload()
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        self._mtime = self._stat_mtime()
+        self._checked = time.monotonic()
+        if self._mtime is None:
+            data = _empty()
+        else:
+            with storage_seconds.time('load_channels'), open(self.path, 'r') as f:
+                data = json.load(f)
+        self._set(data)
+
+    def _set(self, data):
+        self.data = data
+        self.derived = self.build(data) if self.build else None
+
+    def refresh(self):
+        """Reload if the file changed on disk; stats at most once per recheck_interval."""
+        now = time.monotonic()
+        if now - self._checked < self.recheck_interval:
+            return
+        self._checked = now
+        if self._stat_mtime() != self._mtime:
+            logger.info(f"{self.path} changed on disk, reloading")
+            self.reload()
+
+    def exists(self):
+        return self._mtime is not None
+
+    def edit(self):
+        """Return a private copy of the config to modify and pass to save()."""
+        return copy.deepcopy(self.data)
+
+    def save(self, data):
+        atomic_write_json(self.path, data)
+        self._mtime = self._stat_mtime()
+        self._set(data)
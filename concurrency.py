@@ -0,0 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+class KeyedLock:
+    """One asyncio.Lock per key, dropped again once nobody holds or waits on it."""
+
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+            self._users[key] = 0
+        self._users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+class SingleFlight:
+    """Shares one in-flight call per key among everyone who asks for it.
+
+    While run(key, ...) is pending, further run() calls with the same key
+    wait for the same result instead of starting the work again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def run(self, key, factory):
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A cancelled caller must not cancel the work the others wait on
+        return await asyncio.shield(future)
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    def __len__(self):
+        return len(self._calls)
@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# How long a positive getChatMember result is trusted
+MEMBERSHIP_TTL = float(os.getenv("MEMBERSHIP_TTL", "600"))
+# How long a membership seen in a chat_member update is trusted. These come
+# from channels where the bot is admin, so leaves are reported too and the
+# entry only needs to expire in case the bot loses admin rights.
+MEMBERSHIP_INDEX_TTL = float(os.getenv("MEMBERSHIP_INDEX_TTL", "86400"))
+# Entries kept at most; the least recently used are dropped first
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "200000"))
+# Seconds between sweeps for expired entries
+MEMBERSHIP_PRUNE_INTERVAL = 60
+
+LEFT_STATUSES = ('left', 'kicked')
+
+class MembershipCache:
+    """Positive (user, channel) membership results with a TTL.
+
+    Only "is a member" is cached; a negative result is always rechecked so
+    a user who just joined is never told to join again. Expired entries are
+    swept out periodically and the cache holds at most max_size entries.
+    """
+
+    def __init__(self, ttl=MEMBERSHIP_TTL, index_ttl=MEMBERSHIP_INDEX_TTL, max_size=MEMBERSHIP_CACHE_SIZE,
+                 prune_interval=MEMBERSHIP_PRUNE_INTERVAL):
+        self.ttl = ttl
+        self.index_ttl = index_ttl
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        # Least recently used first
+        self._members = OrderedDict()
+        self._next_prune = time.monotonic() + prune_interval
+        self.hits = 0
+        self.misses = 0
+
+    def _is_member(self, user_id, channel_id):
+        key = (user_id, channel_id)
+        expires = self._members.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._members[key]
+            return False
+        self._members.move_to_end(key)
+        return True
+
+    def _remember(self, user_id, channel_id, ttl):
+        key = (user_id, channel_id)
+        now = time.monotonic()
+        self._members[key] = now + ttl
+        self._members.move_to_end(key)
+        if now >= self._next_prune:
+            self.prune(now)
+        while len(self._members) > self.max_size:
+            self._members.popitem(last=False)
+
+    def prune(self, now=None):
+        """Drop expired entries."""
+        now = time.monotonic() if now is None else now
+        self._next_prune = now + self.prune_interval
+        for key in [key for key, expires in self._members.items() if expires < now]:
+            del self._members[key]
+
+    def record_status(self, channel_id, user_id, status):
+        """Update the index from a ChatMemberUpdated event."""
+        channel_id = str(channel_id)
+        if status in LEFT_STATUSES:
+            self._members.pop((user_id, channel_id), None)
+        else:
+            self._remember(user_id, channel_id, self.index_ttl)
+
+    def forget_channel(self, channel_id):
+        """Drop every entry for a channel that is no longer required."""
+        channel_id = str(channel_id)
+        for key in [key for key in self._members if key[1] == channel_id]:
+            del self._members[key]
+
+    async def _fetch(self, bot, user_id, channel):
+        channel_id = str(channel['id'])
+        try:
+            member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+        except Exception as e:
+            logger.error(f"Error checking membership for channel {channel_id}: {e}")
+            return False
+        if member.status in LEFT_STATUSES:
+            return False
+        self._remember(user_id, channel_id, self.ttl)
+        return True
+
+    async def not_joined(self, bot, user_id, channels):
+        """Return the channels user_id has not joined, checking uncached ones concurrently."""
+        to_check = []
+        for channel in channels:
+            if self._is_member(user_id, str(channel['id'])):
+                self.hits += 1
+            else:
+                self.misses += 1
+                to_check.append(channel)
+
+        if not to_check:
+            return []
+        results = await asyncio.gather(*(self._fetch(bot, user_id, channel) for channel in to_check))
+        return [channel for channel, joined in zip(to_check, results) if not joined]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._members),
+        }
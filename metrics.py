@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import bisect
+import functools
+import threading
+from collections import Counter as _Tally
+
+from telegram.request import HTTPXRequest
+
+from webserver import HTTPServer
+
+# Port for the local /metrics endpoint; unset disables it
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# Start the sampling profiler at boot instead of via /debug/profile/start
+METRICS_PROFILE = os.getenv("METRICS_PROFILE") == "1"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge:
+    """A gauge read from a callback at scrape time."""
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # One count per bucket plus +Inf, then sum
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ('le',)
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels_text(names, label_values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, label_values)} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        return False
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, func):
+        return self.register(Gauge(name, help, func))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+handler_latency = registry.histogram(
+    'bot_handler_seconds', "Time spent in update handlers", ('handler',)
+)
+handler_errors = registry.counter(
+    'bot_handler_errors_total', "Exceptions raised by update handlers", ('handler',)
+)
+api_latency = registry.histogram(
+    'bot_api_request_seconds', "Bot API request latency", ('method',)
+)
+api_errors = registry.counter(
+    'bot_api_request_errors_total', "Bot API requests that raised", ('method',)
+)
+storage_seconds = registry.histogram(
+    'bot_storage_seconds', "Storage load, flush and save durations", ('operation',)
+)
+storage_bytes = registry.counter(
+    'bot_storage_bytes_written_total', "Bytes written by the storage layer", ('target',)
+)
+
+def timed_handler(func):
+    """Record the latency of an update handler under its function name."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await func(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and errors per Bot API method."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            api_errors.inc(api_method)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - started, api_method)
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread.
+
+    Output is in collapsed-stack format ("a;b;c count" per line), ready for
+    flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, hz=100):
+        self.interval = 1.0 / hz
+        self.samples = _Tally()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, thread_id=None):
+        if self.running:
+            return
+        self.samples = _Tally()
+        self._stop.clear()
+        target = thread_id or threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, args=(target,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return ''
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.collapsed()
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+profiler = SamplingProfiler()
+
+async def _metrics_route(request):
+    return 200, 'text/plain; version=0.0.4', registry.render().encode()
+
+async def _profile_start(request):
+    profiler.start()
+    return 200, 'text/plain', b'profiling\n'
+
+async def _profile_stop(request):
+    return 200, 'text/plain', profiler.stop().encode()
+
+async def start_server(port=METRICS_PORT, host=METRICS_LISTEN):
+    """Serve /metrics and the profiler toggle. Returns None if no port is configured."""
+    if not port:
+        return None
+    if METRICS_PROFILE:
+        profiler.start()
+    return await HTTPServer({
+        ('GET', '/metrics'): _metrics_route,
+        ('POST', '/debug/profile/start'): _profile_start,
+        ('POST', '/debug/profile/stop'): _profile_stop,
+    }).start(host, int(port))
@@ -0,0 +1,129 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+
+from metrics import registry
+from ratelimit import NOTIFICATION, PRIORITY_NAMES
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+
+send_lag = registry.histogram(
+    'bot_outbound_lag_seconds', "Time from queueing an outbound message to sending it", ('priority',)
+)
+send_errors = registry.counter(
+    'bot_outbound_errors_total', "Outbound messages that failed to send", ('priority',)
+)
+
+class _Outgoing:
+    __slots__ = ('bot', 'chat_id', 'priority', 'texts', 'kwargs', 'future', 'queued_at', 'key')
+
+    def __init__(self, bot, chat_id, priority, text, kwargs, key):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.priority = priority
+        self.texts = [text]
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+        self.key = key
+
+    def text(self):
+        # Repeated identical messages collapse into one line with a count
+        counts = {}
+        for text in self.texts:
+            counts[text] = counts.get(text, 0) + 1
+        return "\n\n".join(text if n == 1 else f"{text} (x{n})" for text, n in counts.items())
+
+class OutboundScheduler:
+    """Background queue for messages nobody is waiting on.
+
+    Handlers hand referral notifications and other side messages to send()
+    and return without awaiting them. Workers send in priority order, and
+    messages marked coalesce=True for a chat that already has one queued
+    at the same priority are merged into it. Rate limiting and RetryAfter
+    are left to the bot's PriorityRateLimiter, which also sees the priority.
+
+    One scheduler can serve several bots: send() takes the bot to send
+    with, falling back to the one given here.
+    """
+
+    def __init__(self, bot=None, workers=OUTBOUND_WORKERS):
+        self.bot = bot
+        self.workers = workers
+        self._heap = []
+        self._seq = 0
+        self._coalescing = {}
+        self._ready = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        for priority, name in enumerate(PRIORITY_NAMES):
+            registry.gauge(
+                f'bot_outbound_queue_depth_{name}', f"Queued {name} messages",
+                lambda priority=priority: self.depth(priority)
+            )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self, priority=None):
+        if priority is None:
+            return len(self._heap)
+        return sum(1 for entry in self._heap if entry[0] == priority)
+
+    def send(self, chat_id, text, priority=NOTIFICATION, coalesce=False, bot=None, **kwargs):
+        """Queue a message; returns a future for the sent Message."""
+        bot = bot or self.bot
+        key = (id(bot), chat_id, priority) if coalesce else None
+        if key is not None:
+            pending = self._coalescing.get(key)
+            if pending is not None:
+                pending.texts.append(text)
+                return pending.future
+
+        item = _Outgoing(bot, chat_id, priority, text, kwargs, key)
+        if key is not None:
+            self._coalescing[key] = item
+        self._seq += 1
+        heapq.heappush(self._heap, (priority, self._seq, item))
+        self._ready.set()
+        return item.future
+
+    async def _worker(self):
+        while True:
+            while not self._heap:
+                self._ready.clear()
+                await self._ready.wait()
+            _, _, item = heapq.heappop(self._heap)
+            if item.key is not None:
+                # From here on new messages for this chat start a new batch
+                del self._coalescing[item.key]
+
+            name = PRIORITY_NAMES[item.priority]
+            try:
+                message = await item.bot.send_message(
+                    chat_id=item.chat_id,
+                    text=item.text(),
+                    rate_limit_args={'priority': item.priority},
+                    **item.kwargs
+                )
+            except Exception as e:
+                send_errors.inc(name)
+                logger.error(f"Failed to send {name} message to {item.chat_id}: {e}")
+                if not item.future.done():
+                    item.future.set_exception(e)
+                    # Nobody may be awaiting this future
+                    item.future.exception()
+                continue
+            send_lag.observe(time.perf_counter() - item.queued_at, name)
+            if not item.future.done():
+                item.future.set_result(message)
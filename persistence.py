@@ -0,0 +1,219 @@
+import os
+import pickle
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import DB_FILE
+from metrics import storage_seconds
+
+logger = logging.getLogger(__name__)
+
+# How often the application hands changed conversation states and
+# user_data to the persistence
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+# Log entries after which a kind is folded into a new snapshot
+COMPACT_AFTER = int(os.getenv("PERSISTENCE_COMPACT_AFTER", "50000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persistence_snapshots (
+    kind TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    log_seq INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS persistence_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key BLOB NOT NULL,
+    value BLOB
+);
+"""
+
+USER_DATA = 'user_data'
+
+def _conversation_kind(name):
+    return f"conversation:{name}"
+
+class SqlitePersistence(BasePersistence):
+    """Conversation states and user_data in SQLite.
+
+    Each kind of data is a pickled snapshot plus an append-only log of the
+    keys that changed since. Changes are appended in one transaction per
+    persistence run, and a kind is compacted into a new snapshot at
+    shutdown or once its log passes COMPACT_AFTER entries. Loading is one
+    unpickle plus a replay of the log, fast enough for a million
+    conversations at startup.
+
+    bot_data, chat_data and callback_data are not stored.
+    """
+
+    def __init__(self, path=DB_FILE, update_interval=PERSISTENCE_INTERVAL, compact_after=COMPACT_AFTER):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        # One thread, so batches reach the database in the order they were made
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+        self._pending = []
+        # The batch still collecting changes, and the most recent batch
+        self._write = None
+        self._last_write = None
+        self._log_sizes = {}
+        # Users with non-empty user_data stored
+        self._user_data_ids = set()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # Reading
+    def _read(self, kind):
+        """Snapshot plus log for kind; returns the data and the last log seq applied."""
+        row = self._conn.execute(
+            "SELECT data, log_seq FROM persistence_snapshots WHERE kind = ?", (kind,)
+        ).fetchone()
+        data, log_seq = (pickle.loads(row[0]), row[1]) if row else ({}, 0)
+        entries = self._conn.execute(
+            "SELECT seq, key, value FROM persistence_log WHERE kind = ? AND seq > ? ORDER BY seq",
+            (kind, log_seq)
+        ).fetchall()
+        for seq, key, value in entries:
+            if value is None:
+                data.pop(pickle.loads(key), None)
+            else:
+                data[pickle.loads(key)] = pickle.loads(value)
+            log_seq = seq
+        self._log_sizes[kind] = len(entries)
+        return data, log_seq
+
+    def _load(self, kind):
+        with self._lock, storage_seconds.time('load_persistence'):
+            return self._read(kind)[0]
+
+    async def get_conversations(self, name):
+        return await self._run(self._load, _conversation_kind(name))
+
+    async def get_user_data(self):
+        data = await self._run(self._load, USER_DATA)
+        self._user_data_ids = set(data)
+        return data
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Writing
+    def _queue(self, kind, key, value):
+        # Every update_* call of one persistence run lands in the same batch:
+        # the application gathers them, so all have queued their change
+        # before the write task gets to run
+        self._pending.append((kind, pickle.dumps(key), None if value is None else pickle.dumps(value)))
+        if self._write is None:
+            self._write = self._last_write = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        batch, self._pending = self._pending, []
+        self._write = None
+        try:
+            await self._run(self._append, batch)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} changes: {e}")
+
+    def _append(self, batch):
+        with self._lock, storage_seconds.time('save_persistence'):
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO persistence_log (kind, key, value) VALUES (?, ?, ?)", batch
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        for kind, _, _ in batch:
+            self._log_sizes[kind] = self._log_sizes.get(kind, 0) + 1
+        for kind, size in list(self._log_sizes.items()):
+            if size >= self.compact_after:
+                self._compact(kind)
+
+    def _compact(self, kind):
+        with self._lock, storage_seconds.time('compact_persistence'):
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                data, log_seq = self._read(kind)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO persistence_snapshots (kind, data, log_seq) VALUES (?, ?, ?)",
+                    (kind, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), log_seq)
+                )
+                self._conn.execute("DELETE FROM persistence_log WHERE kind = ? AND seq <= ?", (kind, log_seq))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._log_sizes[kind] = 0
+        logger.info(f"Compacted {kind}: {len(data)} entries")
+
+    async def update_conversation(self, name, key, new_state):
+        self._queue(_conversation_kind(name), key, new_state)
+
+    async def update_user_data(self, user_id, data):
+        # The application reports every user it saw an update from, almost
+        # always with empty user_data; only real changes are written
+        if data:
+            self._user_data_ids.add(user_id)
+            self._queue(USER_DATA, user_id, data)
+        else:
+            await self.drop_user_data(user_id)
+
+    async def drop_user_data(self, user_id):
+        if user_id in self._user_data_ids:
+            self._user_data_ids.discard(user_id)
+            self._queue(USER_DATA, user_id, None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        # Batches are written in order, so the last one finishing means all have
+        if self._last_write is not None:
+            await self._last_write
+        for kind, size in list(self._log_sizes.items()):
+            if size:
+                await self._run(self._compact, kind)
+        self._executor.shutdown()
+        with self._lock:
+            self._conn.close()
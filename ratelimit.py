@@ -0,0 +1,181 @@
+import os
+import time
+import heapq
+import asyncio
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Telegram allows roughly 30 messages per second across all chats
+MESSAGE_RATE = float(os.getenv("MESSAGE_RATE", "28"))
+
+# Per-user allowance for incoming updates: a sustained rate and a burst
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "5"))
+
+# Endpoints besides send* that count towards Telegram's message limits
+LIMITED_ENDPOINTS = ('editMessageText', 'editMessageCaption', 'copyMessage', 'forwardMessage')
+
+class TokenBucket:
+    """Token bucket that never waits itself.
+
+    try_acquire() takes a token only if one is available; consume() takes
+    one regardless and leaves the bucket in debt. PriorityGate decides who
+    waits and for how long.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self):
+        """Take a token without waiting, going into debt if needed."""
+        self._refill(max(time.monotonic(), self._updated))
+        self._tokens -= 1
+
+    def paused_for(self):
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def try_acquire(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given time, e.g. after a RetryAfter."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = min(self._tokens, 0.0)
+        self._updated = self._paused_until
+
+# Priority classes for outbound Bot API traffic, highest first
+INTERACTIVE, NOTIFICATION, BULK = range(3)
+PRIORITY_NAMES = ('interactive', 'notification', 'bulk')
+
+class PriorityGate:
+    """A token bucket whose waiters are served highest priority first.
+
+    Interactive sends never queue: they take their token straight away,
+    even into debt, and only wait out a RetryAfter pause. Everything else
+    waits behind them, and a caller only gets a token straight away if
+    nobody of the same or a higher priority is already waiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiters = []
+        self._seq = 0
+        self._dispatcher = None
+
+    def waiting(self, priority=None):
+        if priority is None:
+            return len(self._waiters)
+        return sum(1 for waiter in self._waiters if waiter[0] == priority)
+
+    async def acquire(self, priority=INTERACTIVE):
+        if priority == INTERACTIVE:
+            paused = self.bucket.paused_for()
+            if paused:
+                await asyncio.sleep(paused)
+            self.bucket.consume()
+            return
+        if not any(waiter[0] <= priority for waiter in self._waiters) and self.bucket.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            if not self.bucket.try_acquire():
+                await asyncio.sleep(1.0 / self.bucket.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """PTB rate limiter that runs message sends through a PriorityGate.
+
+    Pass rate_limit_args={'priority': NOTIFICATION} (or BULK) to a Bot
+    method to lower its priority; calls without it count as interactive.
+    A RetryAfter pauses every sender and the call is retried.
+    """
+
+    def __init__(self, rate, max_retries=3):
+        self.gate = PriorityGate(rate)
+        self.max_retries = max_retries
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        limited = endpoint.startswith('send') or endpoint in LIMITED_ENDPOINTS
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                await self.gate.acquire(priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.gate.pause(e.retry_after)
+
+class FloodControl:
+    """Token buckets for incoming updates, one per user.
+
+    allow() never waits: an update over the limit is simply refused. A
+    bucket is kept as a (tokens, updated) pair, and buckets that have had
+    time to refill completely carry no state and are pruned.
+    """
+
+    def __init__(self, rate=FLOOD_RATE, burst=FLOOD_BURST, prune_at=10000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._buckets = {}
+        self._min_prune_at = self._prune_at = prune_at
+        self.dropped = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self.dropped += 1
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self._prune_at:
+            self._prune(now)
+        return True
+
+    def _prune(self, now):
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < full_after
+        }
+        self._prune_at = max(self._min_prune_at, 2 * len(self._buckets))
+
+    def __len__(self):
+        return len(self._buckets)
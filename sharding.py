@@ -0,0 +1,254 @@
+import os
+import json
+import bisect
+import signal
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+
+import httpx
+from telegram import Update
+
+from webserver import HTTPServer, MAX_BODY
+
+logger = logging.getLogger(__name__)
+
+# Worker processes to shard update handling across; 0 handles everything
+# in one process
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+# Worker i listens on 127.0.0.1:WORKER_PORT+i for updates from the front
+WORKER_PORT = int(os.getenv("WORKER_PORT", "8600"))
+RING_REPLICAS = 128
+# Updates forwarded to a worker in one request, and queued per worker
+# before the front stops accepting more
+FORWARD_BATCH = 100
+FORWARD_QUEUE = 10000
+POLL_TIMEOUT = 30
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hashing of keys onto nodes.
+
+    Every node owns `replicas` points on the ring and a key belongs to the
+    first point after its hash, so changing the number of workers only
+    moves the users next to the points that were added or removed.
+    """
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted((_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+def update_user_id(update):
+    """The user a raw update belongs to, without parsing it into objects.
+
+    chat_member updates go by the member rather than whoever changed it,
+    since the member's worker is the one caching their memberships.
+    """
+    for kind, payload in update.items():
+        if not isinstance(payload, dict):
+            continue
+        if kind == 'chat_member':
+            return payload['new_chat_member']['user']['id']
+        user = payload.get('from') or payload.get('user')
+        if user:
+            return user['id']
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+def _bodies(updates, limit=MAX_BODY):
+    """(JSON array, update count) pairs holding updates in order, each
+    small enough for the worker's request body limit."""
+    encoded = [json.dumps(update, separators=(',', ':'), ensure_ascii=False).encode() for update in updates]
+    start = 0
+    while start < len(encoded):
+        # Always at least one, so an update over the limit still gets its 413
+        end, size = start + 1, len(encoded[start]) + 2
+        while end < len(encoded) and size + len(encoded[end]) + 1 <= limit:
+            size += len(encoded[end]) + 1
+            end += 1
+        yield b'[' + b','.join(encoded[start:end]) + b']', end - start
+        start = end
+
+class Router:
+    """Forwards updates to the worker that owns their user.
+
+    Each worker has a queue drained by one task, which posts batches in
+    order, so a user's updates reach their worker in the order Telegram
+    sent them. A worker that is down, restarting or failing is retried
+    until it answers.
+    """
+
+    def __init__(self, workers, base_port=WORKER_PORT):
+        self.ring = HashRing(range(workers))
+        self.urls = [f"http://127.0.0.1:{base_port + index}" for index in range(workers)]
+        self._queues = [asyncio.Queue(maxsize=FORWARD_QUEUE) for _ in range(workers)]
+        self._client = httpx.AsyncClient(timeout=30)
+        self._tasks = []
+        self.forwarded = 0
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._forward(index)) for index in range(len(self._queues))]
+
+    async def route(self, path, update):
+        await self._queues[self.ring.node(update_user_id(update))].put((path, update))
+
+    async def _forward(self, index):
+        queue = self._queues[index]
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < FORWARD_BATCH:
+                batch.append(queue.get_nowait())
+            # One request per webhook path, keeping each path's order
+            by_path = {}
+            for path, update in batch:
+                by_path.setdefault(path, []).append(update)
+            for path, updates in by_path.items():
+                for body, count in _bodies(updates):
+                    await self._post(index, path, body, count)
+            for _ in batch:
+                queue.task_done()
+
+    async def _post(self, index, path, body, count):
+        while True:
+            try:
+                response = await self._client.post(
+                    self.urls[index] + path, content=body, headers={'content-type': 'application/json'}
+                )
+                if response.status_code == 200:
+                    self.forwarded += count
+                    return
+                # Workers skip updates they can't parse, so anything but a
+                # server error means the request itself was wrong
+                if response.status_code < 500:
+                    logger.error(f"Worker {index} rejected {count} updates: {response.status_code}")
+                    return
+                logger.warning(f"Worker {index} failed with {response.status_code}, retrying")
+            except httpx.TransportError as e:
+                logger.warning(f"Worker {index} unreachable, retrying: {e}")
+            await asyncio.sleep(0.5)
+
+    async def stop(self, timeout=10):
+        # Let the workers have what was already accepted
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopped with updates still queued for workers")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+async def _api(client, api_url, method, params=None, timeout=None):
+    response = await client.post(f"{api_url}/{method}", json=params or {}, timeout=timeout)
+    return response.json()['result']
+
+async def _poll(router, client, api_url, path):
+    # Raw getUpdates: the front only needs the user id, so updates are
+    # never parsed into objects here
+    offset = None
+    webhook_deleted = False
+    try:
+        while True:
+            try:
+                if not webhook_deleted:
+                    await _api(client, api_url, 'deleteWebhook')
+                    webhook_deleted = True
+                updates = await _api(client, api_url, 'getUpdates', {
+                    'offset': offset, 'timeout': POLL_TIMEOUT, 'allowed_updates': Update.ALL_TYPES,
+                }, timeout=POLL_TIMEOUT + 10)
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                logger.warning(f"Polling failed, retrying: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await router.route(path, update)
+                offset = update['update_id'] + 1
+    finally:
+        if offset is not None:
+            # Confirm what was routed so a restart doesn't get it again
+            try:
+                await _api(client, api_url, 'getUpdates', {'offset': offset, 'limit': 1, 'timeout': 0})
+            except (httpx.HTTPError, ValueError, KeyError):
+                pass
+
+def _webhook_route(router, path, secret):
+    async def receive_update(request):
+        if secret and request.headers.get('x-telegram-bot-api-secret-token') != secret:
+            return 403, 'text/plain', b'forbidden'
+        try:
+            update = json.loads(request.body)
+        except ValueError:
+            return 400, 'text/plain', b'bad request'
+        await router.route(path, update)
+        return 200, 'text/plain', b'ok'
+    return receive_update
+
+def _spawn(context, worker, index, workers):
+    process = context.Process(target=worker, args=(index, workers), name=f"worker-{index}")
+    process.start()
+    return process
+
+async def serve(bots, worker, workers=SHARD_WORKERS, mode='polling', api_url="https://api.telegram.org",
+                listen='0.0.0.0', port=8443, webhook_url=None, secret=None):
+    """Run the front process: start `workers` processes running worker(index,
+    workers), take updates for bots (a list of (token, webhook path)) from
+    Telegram and route them by user. Returns on SIGINT or SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    context = multiprocessing.get_context('spawn')
+    processes = [_spawn(context, worker, index, workers) for index in range(workers)]
+    router = Router(workers)
+    router.start()
+    client = httpx.AsyncClient()
+    server = None
+    pollers = []
+    if mode == 'webhook':
+        routes = {('POST', path): _webhook_route(router, path, secret) for _, path in bots}
+        server = await HTTPServer(routes).start(listen, port)
+        for token, path in bots:
+            if webhook_url:
+                await _api(client, f"{api_url}/bot{token}", 'setWebhook', {
+                    'url': webhook_url + path, 'secret_token': secret,
+                    'allowed_updates': Update.ALL_TYPES, 'max_connections': 100,
+                })
+    else:
+        pollers = [loop.create_task(_poll(router, client, f"{api_url}/bot{token}", path)) for token, path in bots]
+    print(f"Bot is running ({mode}, {len(bots)} bot(s), {workers} workers)...")
+
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            for index, process in enumerate(processes):
+                if process.exitcode is not None and not stop.is_set():
+                    logger.error(f"Worker {index} exited with {process.exitcode}, restarting it")
+                    processes[index] = _spawn(context, worker, index, workers)
+    finally:
+        if server is not None:
+            await server.close()
+        for task in pollers:
+            task.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        await router.stop()
+        await client.aclose()
+        for process in processes:
+            if process.exitcode is None:
+                process.terminate()
+        for process in processes:
+            process.join()
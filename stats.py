@@ -0,0 +1,75 @@
+import os
+
+# How many referrers the leaderboard keeps
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+REFERRAL_GOAL = 3
+
+class TopK:
+    """The k keys with the highest counts, for counts that only go up.
+
+    Since counts never decrease, a key outside the top k can only enter it
+    by being incremented, so calling update() on every increment keeps the
+    list exact at O(k) per update.
+    """
+
+    def __init__(self, k=LEADERBOARD_SIZE):
+        self.k = k
+        self._counts = {}
+
+    def update(self, key, count):
+        if key in self._counts or len(self._counts) < self.k:
+            self._counts[key] = count
+            return
+        lowest = min(self._counts, key=self._counts.get)
+        if count > self._counts[lowest]:
+            del self._counts[lowest]
+            self._counts[key] = count
+
+    def items(self):
+        return sorted(self._counts.items(), key=lambda item: (-item[1], item[0]))
+
+class Stats:
+    """Counters behind /stats, built with one pass at startup and then
+    updated incrementally by the handlers."""
+
+    def __init__(self, k=LEADERBOARD_SIZE):
+        self.users = 0
+        self.referred_users = 0
+        self.referrals = 0
+        self.referrers = 0
+        self.reached_goal = 0
+        self.withdrawals = 0
+        self.leaderboard = TopK(k)
+
+    @classmethod
+    def from_users(cls, users, k=LEADERBOARD_SIZE):
+        stats = cls(k)
+        for user in users:
+            stats.users += 1
+            if user.referred_by is not None:
+                stats.referred_users += 1
+            if user.referral_count:
+                stats.referrals += user.referral_count
+                stats.referrers += 1
+                stats.leaderboard.update(user.user_id, user.referral_count)
+            if user.referral_count >= REFERRAL_GOAL:
+                stats.reached_goal += 1
+            if user.has_withdrawn:
+                stats.withdrawals += 1
+        return stats
+
+    def user_created(self):
+        self.users += 1
+
+    def referral_credited(self, referrer_id, referral_count, first_referrer):
+        self.referrals += 1
+        if first_referrer:
+            self.referred_users += 1
+        if referral_count == 1:
+            self.referrers += 1
+        if referral_count == REFERRAL_GOAL:
+            self.reached_goal += 1
+        self.leaderboard.update(referrer_id, referral_count)
+
+    def withdrawn(self):
+        self.withdrawals += 1
@@ -0,0 +1,926 @@
+import os
+import sys
+import json
+import time
+import glob
+import bisect
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import logging
+
+from metrics import storage_seconds, storage_bytes, registry
+from stats import Stats, REFERRAL_GOAL, LEADERBOARD_SIZE
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = os.getenv("DB_FILE", "bot.db")
+DATA_FILE = 'user_data.json'
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2.0"))
+FLUSH_THRESHOLD = int(os.getenv("FLUSH_THRESHOLD", "500"))
+
+rows_flushed = registry.counter(
+    'bot_storage_rows_flushed_total', "Rows written to SQLite by write-behind flushes", ('table',)
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    points INTEGER NOT NULL DEFAULT 0,
+    referral_count INTEGER NOT NULL DEFAULT 0,
+    has_withdrawn INTEGER NOT NULL DEFAULT 0,
+    referred_by INTEGER,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS referrals (
+    referrer_id INTEGER NOT NULL,
+    referred_id INTEGER NOT NULL,
+    PRIMARY KEY (referrer_id, referred_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS admins (
+    user_id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+# Bumped whenever an existing database needs upgrading, see SqliteStore._upgrade
+SCHEMA_VERSION = 2
+USER_COLUMNS = "user_id, username, points, referral_count, has_withdrawn, referred_by, active"
+# Stats counters live in meta as 'stats.<name>' rows
+STATS_COUNTERS = ('users', 'referred_users', 'referrals', 'referrers', 'reached_goal', 'withdrawals')
+
+# Legacy JSON storage, kept for the migrator and for tooling that still
+# wants the old {'users': ...} shape
+def load_data(path=DATA_FILE):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {'users': {}}
+
+def save_data(data, path=DATA_FILE):
+    atomic_write_json(path, data)
+
+def atomic_write_json(path, data):
+    # Write to a temp file in the same directory and rename over the target,
+    # so readers never see a half-written file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with storage_seconds.time('save_json'), os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+            storage_bytes.inc('json', amount=f.tell())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# Referral ids are kept in a tuple up to this size and in a set beyond it;
+# a scan of a tuple this short is as fast as a set lookup and far smaller
+SMALL_REFERRALS = 8
+
+class User:
+    """Compact in-memory user record.
+
+    Uses __slots__ instead of a per-user dict, interns usernames, stores no
+    username at all for the default "user_<id>" one, and only allocates a
+    referral collection for users who have referred someone.
+    """
+
+    __slots__ = ('user_id', '_username', 'points', 'referral_count', 'has_withdrawn', 'referred_by',
+                 'active', 'referrals')
+
+    def __init__(self, user_id, username=None, points=0, referral_count=0,
+                 has_withdrawn=False, referred_by=None, active=True, referrals=None):
+        self.user_id = user_id
+        self.username = username
+        self.points = points
+        self.referral_count = referral_count
+        self.has_withdrawn = has_withdrawn
+        self.referred_by = referred_by
+        # False once the user has blocked the bot or their chat is gone
+        self.active = active
+        self.referrals = referrals
+
+    @property
+    def username(self):
+        return self._username or f"user_{self.user_id}"
+
+    @username.setter
+    def username(self, value):
+        if not value or value == f"user_{self.user_id}":
+            self._username = None
+        else:
+            self._username = sys.intern(value)
+
+    def __repr__(self):
+        return f"User({self.user_id}, {self.username!r}, referral_count={self.referral_count})"
+
+    def has_referral(self, user_id):
+        return self.referrals is not None and user_id in self.referrals
+
+    def add_referral_id(self, user_id):
+        referrals = self.referrals
+        if referrals is None:
+            self.referrals = (user_id,)
+        elif isinstance(referrals, tuple):
+            referrals += (user_id,)
+            self.referrals = referrals if len(referrals) <= SMALL_REFERRALS else set(referrals)
+        else:
+            referrals.add(user_id)
+
+    def copy(self):
+        """Snapshot of the row fields, without the referral collection."""
+        return User(self.user_id, self._username, self.points, self.referral_count,
+                    self.has_withdrawn, self.referred_by, self.active)
+
+    def to_dict(self):
+        return {
+            'username': self.username,
+            'points': self.points,
+            'referral_count': self.referral_count,
+            'has_withdrawn': self.has_withdrawn,
+            'referred_by': self.referred_by,
+            'active': self.active,
+        }
+
+    @classmethod
+    def from_dict(cls, user_id, data):
+        return cls(user_id, data.get('username'), data.get('points', 0), data.get('referral_count', 0),
+                   bool(data.get('has_withdrawn')), data.get('referred_by'), data.get('active', True))
+
+def _row_to_user(row):
+    return User(row[0], row[1], row[2], row[3], bool(row[4]), row[5], bool(row[6]))
+
+def _legacy_object(data):
+    # object_hook for user_data.json: user objects become User records as
+    # soon as they are parsed, so the full dict-of-dicts never exists
+    if 'has_withdrawn' in data or 'referrals' in data:
+        referrals = data.get('referrals', ())
+        referred_by = data.get('referred_by')
+        user = User(None, None, data.get('points', 0), len(referrals),
+                    bool(data.get('has_withdrawn')), int(referred_by) if referred_by is not None else None)
+        user._username = data.get('username')
+        if referrals:
+            user.referrals = tuple(map(int, referrals)) if len(referrals) <= SMALL_REFERRALS else set(map(int, referrals))
+        return user
+    users = {}
+    for key, value in data.items():
+        if not isinstance(value, User):
+            return data
+        value.user_id = int(key)
+        value.username = value._username
+        users[value.user_id] = value
+    return users
+
+def load_users_from_json(path=DATA_FILE):
+    """Load user_data.json straight into User records keyed by int id."""
+    if not os.path.exists(path):
+        return {'users': {}}
+    with open(path, 'r') as f:
+        return json.load(f, object_hook=_legacy_object)
+
+class SqliteStore:
+    """Per-row user storage on SQLite in WAL mode.
+
+    User ids are ints. All methods are safe to call from worker threads.
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        self._upgrade()
+
+    # Writes go straight to the database, so nothing is ever pending
+    pending_changes = 0
+
+    def start(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    async def aclose(self):
+        self.close()
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def _upgrade(self):
+        # CREATE TABLE IF NOT EXISTS leaves tables from older versions alone,
+        # so add what they are missing
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self._transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+            if 'active' not in columns:
+                conn.execute("ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+            # Broadcast recipients: lets broadcasts page through active users
+            # without reading the rows of ones that blocked the bot
+            conn.execute("CREATE INDEX IF NOT EXISTS users_active ON users (user_id) WHERE active = 1")
+            # The /stats leaderboard, without sorting every referrer
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS users_referral_count "
+                "ON users (referral_count DESC, user_id) WHERE referral_count > 0"
+            )
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # Users
+    def get_user(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return _row_to_user(row) if row else None
+
+    def has_user(self, user_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone() is not None
+
+    def create_user(self, user_id, username):
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
+                (user_id, username)
+            )
+            if cur.rowcount != 1:
+                return False
+            _count(conn, 'users')
+            return True
+
+    def user_count(self, active_only=False):
+        query = "SELECT COUNT(*) FROM users" + (" WHERE active = 1" if active_only else "")
+        with self._lock:
+            return self._conn.execute(query).fetchone()[0]
+
+    def iter_user_ids(self, batch_size=1000, after=None, active_only=False):
+        """Yield user ids in ascending order, optionally starting after a given id
+        and skipping inactive users."""
+        # Keyset pagination so the lock is never held across a yield
+        conditions = ["active = 1"] if active_only else []
+        last = after
+        while True:
+            where = conditions if last is None else conditions + ["user_id > ?"]
+            query = "SELECT user_id FROM users"
+            if where:
+                query += " WHERE " + " AND ".join(where)
+            query += " ORDER BY user_id LIMIT ?"
+            params = (batch_size,) if last is None else (last, batch_size)
+            with self._lock:
+                rows = self._conn.execute(query, params).fetchall()
+            if not rows:
+                return
+            for (user_id,) in rows:
+                yield user_id
+            last = rows[-1][0]
+
+    def iter_users(self, batch_size=1000, referrals=False):
+        """Yield every User in ascending id order, batch_size rows at a time,
+        with their referred ids attached if referrals is set."""
+        columns = f"SELECT {USER_COLUMNS} FROM users"
+        last = None
+        while True:
+            with self._lock:
+                if last is None:
+                    rows = self._conn.execute(
+                        f"{columns} ORDER BY user_id LIMIT ?", (batch_size,)
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        f"{columns} WHERE user_id > ? ORDER BY user_id LIMIT ?", (last, batch_size)
+                    ).fetchall()
+                referral_rows = []
+                if referrals and rows:
+                    # The batch is a contiguous id range, so its referrals are too
+                    referral_rows = self._conn.execute(
+                        "SELECT referrer_id, referred_id FROM referrals WHERE referrer_id BETWEEN ? AND ?",
+                        (rows[0][0], rows[-1][0])
+                    ).fetchall()
+            if not rows:
+                return
+            users = [_row_to_user(row) for row in rows]
+            if referral_rows:
+                by_id = {user.user_id: user for user in users}
+                for referrer_id, referred_id in referral_rows:
+                    if referrer_id in by_id:
+                        by_id[referrer_id].add_referral_id(referred_id)
+            yield from users
+            last = rows[-1][0]
+
+    # Referrals
+    def has_referral(self, referrer_id, user_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM referrals WHERE referrer_id = ? AND referred_id = ?",
+                (referrer_id, user_id)
+            ).fetchone() is not None
+
+    def add_referral(self, referrer_id, user_id):
+        """Credit referrer_id with user_id; returns the new count, or None if not credited."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (referrer_id,)).fetchone() is None:
+                return None
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)",
+                (referrer_id, user_id)
+            )
+            if cur.rowcount != 1:
+                return None
+            conn.execute(
+                "UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ?",
+                (referrer_id,)
+            )
+            referred = conn.execute("SELECT referred_by FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            conn.execute(
+                "UPDATE users SET referred_by = ? WHERE user_id = ?",
+                (referrer_id, user_id)
+            )
+            referral_count = conn.execute(
+                "SELECT referral_count FROM users WHERE user_id = ?", (referrer_id,)
+            ).fetchone()[0]
+            counters = ['referrals']
+            if referred is not None and referred[0] is None:
+                counters.append('referred_users')
+            if referral_count == 1:
+                counters.append('referrers')
+            if referral_count == REFERRAL_GOAL:
+                counters.append('reached_goal')
+            _count(conn, *counters)
+            return referral_count
+
+    def mark_withdrawn(self, user_id):
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE users SET has_withdrawn = 1 WHERE user_id = ? AND has_withdrawn = 0",
+                (user_id,)
+            )
+            if cur.rowcount != 1:
+                return False
+            _count(conn, 'withdrawals')
+            return True
+
+    def set_active(self, user_id, active):
+        """Mark a user as reachable or not; returns True if that changed anything."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE users SET active = ? WHERE user_id = ? AND active != ?",
+                (int(active), user_id, int(active))
+            )
+            return cur.rowcount == 1
+
+    # Admins
+    def get_admins(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT user_id FROM admins")]
+
+    def add_admin(self, user_id):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (str(user_id),)
+            )
+            return cur.rowcount == 1
+
+    # Bulk access used by the write-behind cache
+    def load_all(self):
+        """Every user, and the ids of users with referrals stored; the
+        referrals themselves are read with get_referrals when needed."""
+        with self._lock:
+            users = {
+                row[0]: _row_to_user(row) for row in self._conn.execute(f"SELECT {USER_COLUMNS} FROM users")
+            }
+            referrer_ids = {row[0] for row in self._conn.execute("SELECT DISTINCT referrer_id FROM referrals")}
+        return users, referrer_ids
+
+    def get_referrals(self, referrer_ids):
+        """{referrer_id: [referred ids]} for the given referrers."""
+        referrer_ids = set(referrer_ids)
+        if not referrer_ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT referrer_id, referred_id FROM referrals WHERE referrer_id BETWEEN ? AND ?",
+                (min(referrer_ids), max(referrer_ids))
+            ).fetchall()
+        referrals = {}
+        for referrer_id, referred_id in rows:
+            if referrer_id in referrer_ids:
+                referrals.setdefault(referrer_id, []).append(referred_id)
+        return referrals
+
+    def apply_batch(self, users, referrals, admins):
+        """Write full user states, new referral pairs and admins in one transaction."""
+        with self._transaction() as conn:
+            self._apply(conn, users, referrals, admins)
+
+    def _apply(self, conn, users, referrals, admins):
+        _drop_stats(conn)
+        conn.executemany(
+            f"INSERT INTO users ({USER_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET "
+            "username = excluded.username, points = excluded.points, "
+            "referral_count = excluded.referral_count, has_withdrawn = excluded.has_withdrawn, "
+            "referred_by = excluded.referred_by, active = excluded.active",
+            [
+                (user_id, u.username, u.points, u.referral_count,
+                 int(u.has_withdrawn), u.referred_by, int(u.active))
+                for user_id, u in users.items()
+            ]
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)", referrals
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO admins (user_id) VALUES (?)", [(a,) for a in admins]
+        )
+
+    def import_users(self, users):
+        """Upsert a batch of User records and add their referrals, in one transaction."""
+        with self._transaction() as conn:
+            self._apply(
+                conn,
+                {user.user_id: user for user in users},
+                [(user.user_id, referred_id) for user in users for referred_id in user.referrals or ()],
+                (),
+            )
+            # Referrals credited since the export are kept, so the count
+            # must not fall below them
+            conn.executemany(
+                "UPDATE users SET referral_count = max(referral_count, "
+                "(SELECT COUNT(*) FROM referrals WHERE referrer_id = ?)) WHERE user_id = ?",
+                [(user.user_id, user.user_id) for user in users]
+            )
+
+    # Stats
+    def load_stats(self, k=LEADERBOARD_SIZE):
+        """Stats from the counters kept in meta, without scanning the users.
+
+        create_user, add_referral and mark_withdrawn update the counters in
+        their own transactions. Bulk writes can't tell what they changed,
+        so they drop the counters and the next call counts them again.
+        """
+        with self._transaction() as conn:
+            values = dict(conn.execute("SELECT key, value FROM meta WHERE key LIKE 'stats.%'").fetchall())
+            if len(values) < len(STATS_COUNTERS):
+                row = conn.execute(
+                    "SELECT COUNT(*), COUNT(referred_by), TOTAL(referral_count), SUM(referral_count > 0), "
+                    "SUM(referral_count >= ?), SUM(has_withdrawn) FROM users",
+                    (REFERRAL_GOAL,)
+                ).fetchone()
+                values = {f"stats.{name}": int(value or 0) for name, value in zip(STATS_COUNTERS, row)}
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items())
+            leaders = conn.execute(
+                "SELECT user_id, referral_count FROM users WHERE referral_count > 0 "
+                "ORDER BY referral_count DESC, user_id LIMIT ?", (k,)
+            ).fetchall()
+        stats = Stats(k)
+        for name in STATS_COUNTERS:
+            setattr(stats, name, int(values[f"stats.{name}"]))
+        for user_id, referral_count in leaders:
+            stats.leaderboard.update(user_id, referral_count)
+        return stats
+
+    # Meta
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+
+def _count(conn, *names):
+    # Counters that were dropped stay dropped until load_stats() recounts
+    conn.executemany("UPDATE meta SET value = value + 1 WHERE key = ?", [(f"stats.{name}",) for name in names])
+
+def _drop_stats(conn):
+    conn.execute("DELETE FROM meta WHERE key LIKE 'stats.%'")
+
+class _Transaction:
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
+
+def replay_journals(backend, journal_path=None):
+    """Apply a WriteBehindStore's unflushed journals to backend and delete them."""
+    journal_path = journal_path or backend.path + '.journal'
+    paths = sorted(glob.glob(journal_path + '.*'))
+    if os.path.exists(journal_path):
+        paths.append(journal_path)
+    if not paths:
+        return
+
+    users, referrals, admins = {}, [], set()
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-write
+                    continue
+                if entry['op'] == 'user':
+                    users[entry['id']] = User.from_dict(entry['id'], entry['state'])
+                elif entry['op'] == 'referral':
+                    referrals.append((entry['referrer'], entry['referred']))
+                elif entry['op'] == 'admin':
+                    admins.add(entry['id'])
+
+    backend.apply_batch(users, referrals, admins)
+    for path in paths:
+        os.unlink(path)
+    logger.info(f"Replayed {len(users)} user changes from {len(paths)} journal file(s)")
+
+class WriteBehindStore:
+    """In-memory user store in front of a SqliteStore.
+
+    The in-memory dicts are the source of truth. Every change is appended
+    to a journal file and the changed users are marked dirty; dirty users
+    are written to the backend in batches from a worker thread, either on a
+    timer or once FLUSH_THRESHOLD changes are pending. The journal is
+    replayed on startup, so a crash between flushes loses nothing.
+
+    Users are all loaded at startup, since counts, broadcasts and the
+    active index need every one of them. Referred ids are loaded lazily,
+    per referrer, the first time a referral of theirs is checked.
+
+    Same interface as SqliteStore. Records returned by get_user are shared
+    and must be treated as read-only.
+    """
+
+    def __init__(self, backend, journal_path=None,
+                 flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD):
+        self.backend = backend
+        self.journal_path = journal_path or backend.path + '.journal'
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+
+        with storage_seconds.time('replay'):
+            replay_journals(backend, self.journal_path)
+        with storage_seconds.time('load'):
+            # Referrers whose referred ids are still only in the backend
+            self._users, self._unloaded_referrals = backend.load_all()
+        # Broadcast recipients, so broadcasts don't scan every user
+        self._active_ids = {user_id for user_id, user in self._users.items() if user.active}
+        self._admins = set(backend.get_admins())
+
+        self._dirty_users = set()
+        self._pending_referrals = []
+        self._pending_admins = set()
+        self._journal = open(self.journal_path, 'a')
+        self._journal_seq = 0
+        # Rotated journals whose changes a failed flush put back in pending
+        self._unwritten_journals = []
+        self._flushing = False
+        self._flush_task = None
+        # The batch being written in a worker thread, if any
+        self._write_task = None
+
+    # Journal
+    def _log(self, entry):
+        # A plain append to the page cache: survives a process crash without
+        # an fsync on the hot path
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        self._journal.write(line)
+        self._journal.flush()
+        storage_bytes.inc('journal', amount=len(line))
+
+    def _mark_dirty(self, user_id):
+        self._dirty_users.add(user_id)
+        self._log({'op': 'user', 'id': user_id, 'state': self._users[user_id].to_dict()})
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self.pending_changes < self.flush_threshold or self._flushing:
+            return
+        try:
+            asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            pass
+
+    # Flushing
+    def start(self):
+        """Start the periodic flusher on the running event loop."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush user data: {e}")
+
+    def _take_batch(self):
+        # Snapshot pending changes and rotate the journal, on the loop thread
+        users = {user_id: self._users[user_id].copy() for user_id in self._dirty_users}
+        batch = (users, self._pending_referrals, self._pending_admins)
+        self._dirty_users = set()
+        self._pending_referrals = []
+        self._pending_admins = set()
+
+        self._journal.close()
+        self._journal_seq += 1
+        rotated = f"{self.journal_path}.{time.time_ns():020d}.{self._journal_seq}"
+        os.replace(self.journal_path, rotated)
+        self._journal = open(self.journal_path, 'a')
+        journals, self._unwritten_journals = self._unwritten_journals + [rotated], []
+        return batch, journals
+
+    def _write_batch(self, batch, journals):
+        users, referrals, admins = batch
+        with storage_seconds.time('flush'):
+            self.backend.apply_batch(users, referrals, admins)
+        rows_flushed.inc('users', amount=len(users))
+        rows_flushed.inc('referrals', amount=len(referrals))
+        rows_flushed.inc('admins', amount=len(admins))
+        # Only now is everything these journals hold in the database
+        for path in journals:
+            os.unlink(path)
+
+    def _requeue(self, batch, journals):
+        # The in-memory users are still current, so marking them dirty again
+        # is enough; their journals stay on disk until a flush succeeds
+        users, referrals, admins = batch
+        self._dirty_users.update(users)
+        self._pending_referrals[:0] = referrals
+        self._pending_admins.update(admins)
+        self._unwritten_journals = journals + self._unwritten_journals
+
+    @property
+    def pending_changes(self):
+        return len(self._dirty_users) + len(self._pending_referrals) + len(self._pending_admins)
+
+    async def flush(self):
+        # Only one flush runs at a time; changes made meanwhile go in the next one
+        if self._flushing:
+            return
+        if not (self._dirty_users or self._pending_referrals or self._pending_admins):
+            return
+        self._flushing = True
+        batch, journals = self._take_batch()
+        self._write_task = asyncio.get_running_loop().create_task(self._write(batch, journals))
+        # A cancelled caller doesn't stop a write that already started
+        await asyncio.shield(self._write_task)
+
+    async def _write(self, batch, journals):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_batch, batch, journals)
+        except BaseException:
+            self._requeue(batch, journals)
+            raise
+        finally:
+            self._flushing = False
+
+    async def aclose(self):
+        """Wait for a flush that is still writing, then close."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._write_task is not None:
+            await asyncio.wait([self._write_task])
+        self.close()
+
+    def close(self):
+        """Write what is pending and close; use aclose() while a flush may
+        be running."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._dirty_users or self._pending_referrals or self._pending_admins:
+            self._write_batch(*self._take_batch())
+        self._journal.close()
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) == 0:
+            os.unlink(self.journal_path)
+        self.backend.close()
+
+    # Users
+    def get_user(self, user_id):
+        return self._users.get(user_id)
+
+    def has_user(self, user_id):
+        return user_id in self._users
+
+    def create_user(self, user_id, username):
+        if user_id in self._users:
+            return False
+        self._users[user_id] = User(user_id, username)
+        self._active_ids.add(user_id)
+        self._mark_dirty(user_id)
+        return True
+
+    def user_count(self, active_only=False):
+        return len(self._active_ids if active_only else self._users)
+
+    def iter_user_ids(self, batch_size=1000, after=None, active_only=False):
+        user_ids = sorted(self._active_ids if active_only else self._users)
+        if after is not None:
+            user_ids = user_ids[bisect.bisect_right(user_ids, after):]
+        return iter(user_ids)
+
+    def iter_users(self, batch_size=1000, referrals=False):
+        # The ids are copied up front, so exports and recounts can run this
+        # in a worker thread. Referrals not loaded yet are read a batch at a
+        # time and attached to copies, leaving the shared records alone.
+        user_ids = sorted(self._users)
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            stored = {}
+            if referrals:
+                stored = self.backend.get_referrals(
+                    user_id for user_id in batch if user_id in self._unloaded_referrals
+                )
+            for user_id in batch:
+                user = self._users.get(user_id)
+                if user is None:
+                    continue
+                if user_id in stored:
+                    referred_ids = set(user.referrals or ())
+                    referred_ids.update(stored[user_id])
+                    user = user.copy()
+                    user.referrals = referred_ids
+                yield user
+
+    def load_stats(self, k=LEADERBOARD_SIZE):
+        return Stats.from_users(self.iter_users(), k)
+
+    # Referrals
+    def _referrer(self, referrer_id):
+        # The record with its referred ids loaded
+        referrer = self._users.get(referrer_id)
+        if referrer is not None and referrer_id in self._unloaded_referrals:
+            for referred_id in self.backend.get_referrals((referrer_id,)).get(referrer_id, ()):
+                if not referrer.has_referral(referred_id):
+                    referrer.add_referral_id(referred_id)
+            self._unloaded_referrals.discard(referrer_id)
+        return referrer
+
+    def has_referral(self, referrer_id, user_id):
+        referrer = self._referrer(referrer_id)
+        return referrer is not None and referrer.has_referral(user_id)
+
+    def add_referral(self, referrer_id, user_id):
+        referrer = self._referrer(referrer_id)
+        if referrer is None or referrer.has_referral(user_id):
+            return None
+        referrer.add_referral_id(user_id)
+        referrer.referral_count += 1
+        self._pending_referrals.append((referrer_id, user_id))
+        self._log({'op': 'referral', 'referrer': referrer_id, 'referred': user_id})
+        self._mark_dirty(referrer_id)
+        if user_id in self._users:
+            self._users[user_id].referred_by = referrer_id
+            self._mark_dirty(user_id)
+        return referrer.referral_count
+
+    def mark_withdrawn(self, user_id):
+        user = self._users.get(user_id)
+        if user is None or user.has_withdrawn:
+            return False
+        user.has_withdrawn = True
+        self._mark_dirty(user_id)
+        return True
+
+    def set_active(self, user_id, active):
+        user = self._users.get(user_id)
+        if user is None or user.active == active:
+            return False
+        user.active = active
+        if active:
+            self._active_ids.add(user_id)
+        else:
+            self._active_ids.discard(user_id)
+        self._mark_dirty(user_id)
+        return True
+
+    def import_users(self, users):
+        """Replace users with the given records; referrals already credited are kept."""
+        for user in users:
+            existing = self._referrer(user.user_id)
+            imported = dict.fromkeys(user.referrals or ())
+            user.referrals = existing.referrals if existing is not None else None
+            for referred_id in imported:
+                if user.has_referral(referred_id):
+                    continue
+                user.add_referral_id(referred_id)
+                self._pending_referrals.append((user.user_id, referred_id))
+                self._log({'op': 'referral', 'referrer': user.user_id, 'referred': referred_id})
+            # Referrals credited since the export are kept, so the count
+            # must not fall below them
+            user.referral_count = max(user.referral_count, len(user.referrals or ()))
+            self._users[user.user_id] = user
+            if user.active:
+                self._active_ids.add(user.user_id)
+            else:
+                self._active_ids.discard(user.user_id)
+            self._mark_dirty(user.user_id)
+
+    # Admins
+    def get_admins(self):
+        return list(self._admins)
+
+    def add_admin(self, user_id):
+        user_id = str(user_id)
+        if user_id in self._admins:
+            return False
+        self._admins.add(user_id)
+        self._pending_admins.add(user_id)
+        self._log({'op': 'admin', 'id': user_id})
+        self._maybe_flush()
+        return True
+
+    # Meta is rarely written, so it goes straight to the backend
+    def get_meta(self, key, default=None):
+        return self.backend.get_meta(key, default)
+
+    def set_meta(self, key, value):
+        self.backend.set_meta(key, value)
+
+def migrate_from_json(store, data_file=DATA_FILE, batch_size=5000):
+    """One-shot import of the legacy user_data.json into store.
+
+    Runs once per database; later calls are no-ops. Returns the number of
+    users imported.
+    """
+    if store.get_meta('migrated_from_json'):
+        return 0
+    if not os.path.exists(data_file):
+        store.set_meta('migrated_from_json', 'none')
+        return 0
+
+    data = load_users_from_json(data_file)
+    users = data.get('users', {})
+
+    user_rows = []
+    referral_rows = []
+    for user_id, user in users.items():
+        user_rows.append((
+            user_id, user.username, user.points, user.referral_count,
+            int(user.has_withdrawn), user.referred_by,
+        ))
+        referral_rows.extend((user_id, r) for r in user.referrals or ())
+
+    with store._transaction() as conn:
+        _drop_stats(conn)
+        for i in range(0, len(user_rows), batch_size):
+            conn.executemany(
+                "INSERT OR REPLACE INTO users "
+                "(user_id, username, points, referral_count, has_withdrawn, referred_by) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                user_rows[i:i + batch_size]
+            )
+        for i in range(0, len(referral_rows), batch_size):
+            conn.executemany(
+                "INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)",
+                referral_rows[i:i + batch_size]
+            )
+        conn.executemany(
+            "INSERT OR IGNORE INTO admins (user_id) VALUES (?)",
+            [(str(a),) for a in data.get('admins', [])]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+            (data_file,)
+        )
+
+    logger.info(f"Migrated {len(user_rows)} users from {data_file} to {store.path}")
+    return len(user_rows)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    source = sys.argv[1] if len(sys.argv) > 1 else DATA_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else DB_FILE
+    store = SqliteStore(target)
+    count = migrate_from_json(store, source)
+    print(f"Imported {count} users into {target}")
+    store.close()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from collections import namedtuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 1024 * 1024
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'headers', 'body'])
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+class HTTPServer:
+    """Minimal HTTP/1.1 server on asyncio streams, with keep-alive.
+
+    routes maps (method, path) to a coroutine taking a Request and returning
+    (status, content_type, body_bytes). It is enough for the webhook and
+    local debug endpoints without pulling in a web framework.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self._server = None
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"HTTP server listening on {host}:{port}")
+        return self
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, 'text/plain', b'', close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                path, _, query = target.partition('?')
+                request = Request(method, path, parse_qs(query), headers, body)
+                status, content_type, payload = await self._dispatch(request)
+
+                close = version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close'
+                await self._respond(writer, status, content_type, payload, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            return 404, 'text/plain', b'not found'
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return 500, 'text/plain', b'error'
+
+    async def _respond(self, writer, status, content_type, payload, close=False):
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()